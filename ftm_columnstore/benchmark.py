@@ -0,0 +1,97 @@
+"""
+Compare the client settings profiles (`settings.PROFILES`) with the client
+defaults for the operations of a dataset:
+
+- lookup: single entities by `canonical_id`
+- export: all statements in primary key order
+- ingest: re-insert the statements into a temporary copy of the table
+"""
+
+import logging
+import random
+import time
+from typing import Callable, TypedDict
+from uuid import uuid4
+
+from nomenklatura.dataset import DS
+from nomenklatura.entity import CE
+
+from ftm_columnstore.engine import ClickhouseEngine
+from ftm_columnstore.store import BaseClickhouseStore
+
+log = logging.getLogger(__name__)
+
+
+class BenchmarkResult(TypedDict):
+    operation: str
+    profile: str | None
+    rows: int
+    seconds: float
+
+
+def _lookup(
+    store: BaseClickhouseStore[DS, CE], ids: list[str], profile: str | None
+) -> int:
+    rows = 0
+    for id_ in ids:
+        q = f"SELECT * FROM {store.engine.table} WHERE canonical_id = '{id_}'"
+        rows += len(list(store._execute(q, stream=False, profile=profile)))
+    return rows
+
+
+def _export(
+    store: BaseClickhouseStore[DS, CE], dataset: str, profile: str | None
+) -> int:
+    q = f"""SELECT * FROM {store.engine.table} WHERE dataset = '{dataset}'
+    ORDER BY canonical_id"""
+    return sum(1 for _ in store._execute(q, profile=profile))
+
+
+def _ingest(engine: ClickhouseEngine, dataset: str, profile: str | None) -> int:
+    table = f"{engine.table}_benchmark_{uuid4().hex}"
+    q = f"SELECT * FROM {engine.table} WHERE dataset = '{dataset}'"
+    with engine.connect() as conn:
+        conn.execute(f"CREATE TABLE {table} AS {engine.table}")
+    try:
+        return sum(
+            engine.insert(df, table, profile) for df in engine.query_dataframes(q)
+        )
+    finally:
+        with engine.connect() as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def benchmark(
+    store: BaseClickhouseStore[DS, CE], dataset: str, samples: int | None = 100
+) -> list[BenchmarkResult]:
+    """
+    Run each operation with the client defaults (`profile=None`) and with
+    its profile, after one warm-up run so that both read from warm caches
+    """
+    with store.engine.connect() as conn:
+        cursor = conn.execute(
+            f"""SELECT DISTINCT canonical_id FROM {store.engine.table}
+            WHERE dataset = '{dataset}'"""
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+    if samples is not None:
+        ids = random.sample(ids, min(samples, len(ids)))
+    operations: dict[str, Callable[[str | None], int]] = {
+        "lookup": lambda p: _lookup(store, ids, p),
+        "export": lambda p: _export(store, dataset, p),
+        "ingest": lambda p: _ingest(store.engine, dataset, p),
+    }
+    results: list[BenchmarkResult] = []
+    for operation, func in operations.items():
+        func(None)
+        for profile in (None, operation):
+            start = time.time()
+            rows = func(profile)
+            seconds = time.time() - start
+            log.info(f"{operation} ({profile}): {rows} rows in {seconds:.2f}s")
+            results.append(
+                BenchmarkResult(
+                    operation=operation, profile=profile, rows=rows, seconds=seconds
+                )
+            )
+    return results
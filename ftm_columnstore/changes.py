@@ -0,0 +1,138 @@
+"""
+Statement level change feed between dataset versions.
+
+Re-importing a dataset updates `last_seen` of all statements that are still
+present and inserts new statements with `first_seen` set to the import time,
+so the statements of the latest version are the ones last seen at the latest
+`last_seen` of the dataset. The writer stamps statements without timestamps
+with the time of its run and carries over `first_seen` of already stored
+statements, so a version is a (full) import run. Partial updates create a new
+version as well, in which the statements not written again count as removed. Given the timestamp of a previous version
+(`since`), the statement ids of a dataset fall into these sets:
+
+- added: first seen after `since` and still present in the latest version
+- removed: present at `since` but not in the latest version
+  (`since <= last_seen < latest`)
+- kept: present at `since` and in the latest version
+- everything else (gone before `since` or added and removed after it) is
+  ignored
+
+Entities (by `canonical_id`) with only added statements are new, entities with
+only removed statements are gone and entities with added or removed statements
+next to kept ones have changed.
+"""
+
+from collections.abc import Iterable
+from datetime import datetime
+from enum import StrEnum
+
+from nomenklatura.statement import Statement
+
+
+class ChangeType(StrEnum):
+    added = "added"
+    changed = "changed"
+    removed = "removed"
+
+
+def get_since(since: datetime | str) -> str:
+    if isinstance(since, datetime):
+        since = since.isoformat()
+    return f"parseDateTime64BestEffort('{since}', 3)"
+
+
+def get_latest(table: str, dataset: str) -> str:
+    return f"(SELECT max(last_seen) FROM {table} WHERE dataset = '{dataset}')"
+
+
+def get_unstamped_query(table: str, dataset: str) -> str:
+    """
+    Count the statements of `dataset` that were written without a `last_seen`
+    timestamp (stored as the epoch)
+    """
+    return f"""
+    SELECT count() FROM {table}
+    WHERE dataset = '{dataset}' AND last_seen = toDateTime64(0, 3)
+    """
+
+
+def get_first_seen_query(table: str, statements: Iterable[Statement]) -> str:
+    """
+    Get the earliest `first_seen` (or `last_seen`) of the given statements
+    already stored in `table`
+    """
+    canonical_ids = ", ".join({f"'{s.canonical_id}'" for s in statements})
+    ids = ", ".join({f"'{s.id}'" for s in statements})
+    return f"""
+    SELECT id, min(coalesce(first_seen, last_seen)) FROM {table}
+    WHERE canonical_id IN ({canonical_ids}) AND id IN ({ids})
+    AND last_seen > toDateTime64(0, 3)
+    GROUP BY id
+    """
+
+
+def get_changes_query(table: str, dataset: str, since: datetime | str) -> str:
+    """
+    Get the `canonical_id` and `ChangeType` of all entities of `dataset` that
+    changed between the version at the given timestamp and the latest version
+    """
+    since = get_since(since)
+    latest = get_latest(table, dataset)
+    return f"""
+    SELECT
+        canonical_id,
+        multiIf(
+            added = statements, '{ChangeType.added}',
+            removed = statements, '{ChangeType.removed}',
+            '{ChangeType.changed}'
+        ) AS change
+    FROM (
+        SELECT
+            canonical_id,
+            count() AS statements,
+            countIf(NOT previous) AS added,
+            countIf(NOT current) AS removed
+        FROM (
+            SELECT
+                canonical_id,
+                id,
+                min(coalesce(first_seen, last_seen)) <= {since}
+                AND max(last_seen) >= {since} AS previous,
+                max(last_seen) >= {latest} AS current
+            FROM {table}
+            WHERE dataset = '{dataset}'
+            GROUP BY canonical_id, id
+            HAVING previous OR current
+        )
+        GROUP BY canonical_id
+        HAVING added > 0 OR removed > 0
+    )
+    """
+
+
+def get_changed_statements_query(
+    table: str, columns: list[str], dataset: str, since: datetime | str
+) -> str:
+    """
+    Get the statements of all changed entities in their latest version,
+    ordered by `canonical_id`. Removed entities are returned in their version
+    at `since`
+    """
+    changes = get_changes_query(table, dataset, since)
+    since = get_since(since)
+    latest = get_latest(table, dataset)
+    fields = ", ".join(columns)
+    return f"""
+    WITH changes AS ({changes})
+    SELECT {fields} FROM {table}
+    WHERE dataset = '{dataset}'
+    AND canonical_id IN (SELECT canonical_id FROM changes)
+    AND if(
+        canonical_id IN (
+            SELECT canonical_id FROM changes WHERE change = '{ChangeType.removed}'
+        ),
+        coalesce(first_seen, last_seen) <= {since} AND last_seen >= {since},
+        last_seen >= {latest}
+    )
+    ORDER BY canonical_id
+    """
@@ -1,23 +1,59 @@
 import logging
-from typing import Annotated, Optional
+from datetime import datetime
+from pathlib import Path
+from typing import Annotated, Any, Optional
 
 import typer
+from ftmq.io import smart_write_proxies
+from nomenklatura.entity import CE, CompositeEntity
+from nomenklatura.resolver import Resolver
 from rich import print
+from rich.table import Table
 
-from ftm_columnstore import get_engine, settings
+from ftm_columnstore import get_engine, get_store, settings
+from ftm_columnstore.benchmark import benchmark
+from ftm_columnstore.engine import SlowQuery
+from ftm_columnstore.explain import get_report, get_slow_queries
+from ftm_columnstore.ingest import get_state_path, load_manifest, write_many
+from ftm_columnstore.phonetic import PhoneticAlgorithm
+from ftm_columnstore.reindex import reindex_fpx
+from ftm_columnstore.xref import load_resolver, write_resolver
 
 log = logging.getLogger(__name__)
 
 cli = typer.Typer(no_args_is_help=True)
 
 
+def _to_dict(proxy: CE) -> dict[str, Any]:
+    data = proxy.to_dict()
+    for key in ("first_seen", "last_seen", "last_change"):
+        if isinstance(data.get(key), datetime):
+            data[key] = data[key].isoformat()
+    return data
+
+
 @cli.callback(invoke_without_command=True)
 def cli_version(
-    version: Annotated[Optional[bool], typer.Option(..., help="Show version")] = False
-):
+    version: Annotated[Optional[bool], typer.Option(..., help="Show version")] = False,
+    profile_settings: Annotated[
+        Optional[list[str]],
+        typer.Option(
+            "-S",
+            help="Override client settings of an operation profile "
+            "(`<profile>.<key>=<value>`, e.g. `ingest.compression=zstd`)",
+        ),
+    ] = None,
+) -> None:
     if version:
         print(settings.VERSION)
         raise typer.Exit()
+    for item in profile_settings or []:
+        try:
+            key, value = item.split("=", 1)
+            profile, key = key.split(".", 1)
+            settings.PROFILES[profile][key] = value
+        except (KeyError, ValueError):
+            raise typer.BadParameter(f"Invalid profile setting: `{item}`")
 
 
 @cli.command("init", help="Initialize database and table.")
@@ -27,10 +63,16 @@ def cli_init(
         typer.Option(
             ..., help="Recreate tables if existing (requires DROP TABLE privileges)"
         ),
-    ] = False
-):
+    ] = False,
+    backfill: Annotated[
+        Optional[bool],
+        typer.Option(..., help="Populate derived tables from existing statements"),
+    ] = False,
+) -> None:
     engine = get_engine()
     engine.ensure(recreate=recreate, exists_ok=True)
+    if backfill:
+        engine.backfill()
 
 
 @cli.command("optimize")
@@ -39,9 +81,248 @@ def cli_optimize(
         Optional[bool],
         typer.Option(..., help="dedupe full"),
     ] = False,
-):
+    incremental: Annotated[
+        Optional[bool],
+        typer.Option(..., help="dedupe only fragmented partitions"),
+    ] = False,
+    concurrency: Annotated[
+        int,
+        typer.Option(..., help="Partitions to optimize in parallel (incremental)"),
+    ] = settings.OPTIMIZE_CONCURRENCY,
+    timeout: Annotated[
+        int,
+        typer.Option(..., help="Time budget in seconds (incremental)"),
+    ] = settings.OPTIMIZE_TIMEOUT,
+) -> None:
     """
     Perform clickhouse table optimizations
     """
     engine = get_engine()
-    engine.optimize(full)
+    if incremental:
+        engine.optimize()
+        for partition in engine.optimize_partitions(concurrency, timeout):
+            print(partition)
+    else:
+        engine.optimize(full)
+
+
+@cli.command("xref-export")
+def cli_xref_export(
+    out_path: Annotated[
+        Path, typer.Option("-o", help="Output path for nomenklatura resolver json")
+    ],
+    datasets: Annotated[
+        Optional[list[str]],
+        typer.Option("-d", help="Dataset(s) to export judgements for"),
+    ] = None,
+) -> None:
+    """
+    Export xref judgements into a nomenklatura resolver file
+    """
+    resolver = load_resolver(get_engine(), datasets=datasets)
+    resolver.path = out_path
+    resolver.save()
+
+
+@cli.command("xref-import")
+def cli_xref_import(
+    in_path: Annotated[
+        Path, typer.Option("-i", help="Input path of nomenklatura resolver json")
+    ],
+) -> None:
+    """
+    Import judgements of a nomenklatura resolver file into the xref table
+    """
+    resolver: Resolver[CompositeEntity] = Resolver.load(in_path)
+    write_resolver(resolver, get_engine())
+
+
+@cli.command("changes")
+def cli_changes(
+    dataset: Annotated[str, typer.Option("-d", help="Dataset")],
+    since: Annotated[
+        datetime, typer.Option(..., help="Timestamp of the previous version")
+    ],
+    out_uri: Annotated[str, typer.Option("-o", help="Output uri")] = "-",
+) -> None:
+    """
+    Write the added, changed and removed entities of a dataset since the given
+    version as json lines of `{"change": ..., "entity": ...}`
+    """
+    store = get_store(dataset=dataset)
+    changes = (
+        {"change": change, "entity": _to_dict(proxy)}
+        for change, proxy in store.changes(dataset, since)
+    )
+    smart_write_proxies(out_uri, changes)
+
+
+@cli.command("expand")
+def cli_expand(
+    ids: Annotated[list[str], typer.Option("-i", help="Entity id(s) to start from")],
+    dataset: Annotated[
+        Optional[str], typer.Option("-d", help="Dataset to expand within")
+    ] = None,
+    depth: Annotated[int, typer.Option(..., help="Number of hops")] = 1,
+    schemata: Annotated[
+        Optional[list[str]],
+        typer.Option("-s", help="Only traverse entities of these schemata"),
+    ] = None,
+    limit: Annotated[
+        int, typer.Option(..., help="Maximum number of entities")
+    ] = settings.EXPAND_LIMIT,
+    fanout: Annotated[
+        int, typer.Option(..., help="Maximum number of neighbours per entity")
+    ] = settings.EXPAND_FANOUT,
+    out_uri: Annotated[str, typer.Option("-o", help="Output uri")] = "-",
+) -> None:
+    """
+    Write the entities within `depth` hops of the given entity ids
+    """
+    store = get_store(dataset=dataset)
+    proxies = store.expand(ids, depth, schemata, limit, fanout)
+    smart_write_proxies(out_uri, (_to_dict(p) for p in proxies))
+
+
+@cli.command("explain")
+def cli_explain(
+    query: Annotated[
+        Optional[str], typer.Option("-q", help="Explain this query only")
+    ] = None,
+    threshold: Annotated[
+        float, typer.Option(..., help="Minimum query latency in seconds")
+    ] = settings.SLOW_QUERY_THRESHOLD,
+    since: Annotated[
+        Optional[datetime], typer.Option(..., help="Only queries since")
+    ] = None,
+    limit: Annotated[int, typer.Option(..., help="Maximum number of queries")] = 20,
+    plan: Annotated[
+        Optional[bool], typer.Option(..., help="Show the query plans")
+    ] = False,
+) -> None:
+    """
+    Rank slow queries on the store tables (from `system.query_log`) by read
+    rows, full scans and latency, with their primary key and projection usage
+    """
+    engine = get_engine()
+    if query is not None:
+        queries = [SlowQuery(query_id="", query=query, elapsed=0)]
+    else:
+        queries = get_slow_queries(engine, threshold, since, limit)
+    table = Table(
+        "query_id",
+        "elapsed",
+        "read_rows",
+        "read_bytes",
+        "memory_usage",
+        "granules",
+        "scan",
+        "query",
+    )
+    for report in get_report(queries, engine):
+        table.add_row(
+            report["query_id"],
+            f"{report['elapsed']:.2f}",
+            str(report["read_rows"]),
+            str(report["read_bytes"]),
+            str(report["memory_usage"]),
+            f"{report['granules']}/{report['granules_total']}",
+            "full" if report["full_scan"] else ", ".join(report["projections"]),
+            report["plan"] if plan else " ".join(report["query"].split())[:200],
+        )
+    print(table)
+
+
+@cli.command("reindex-fpx")
+def cli_reindex_fpx(
+    datasets: Annotated[
+        Optional[list[str]],
+        typer.Option("-d", help="Dataset(s) to rebuild (default all)"),
+    ] = None,
+    algorithms: Annotated[
+        Optional[list[PhoneticAlgorithm]],
+        typer.Option("-a", help="Phonetic algorithm(s) to rebuild (default all)"),
+    ] = None,
+    concurrency: Annotated[
+        int, typer.Option(..., help="Parallel shards per dataset")
+    ] = settings.REINDEX_CONCURRENCY,
+    chunksize: Annotated[
+        int, typer.Option(..., help="Name values per chunk")
+    ] = settings.BULK_WRITE_SIZE,
+) -> None:
+    """
+    Rebuild the fingerprint table from the name statements and swap it in per
+    dataset
+    """
+    res = reindex_fpx(get_engine(), datasets, algorithms, concurrency, chunksize)
+    for dataset, rows in res.items():
+        print(f"{dataset}: {rows} fingerprints")
+
+
+@cli.command("write-many")
+def cli_write_many(
+    manifest: Annotated[
+        Path, typer.Option("-i", help="Manifest (yaml or json) of dataset sources")
+    ],
+    concurrency: Annotated[
+        int, typer.Option(..., help="Datasets to write in parallel")
+    ] = settings.WRITE_MANY_CONCURRENCY,
+    memory: Annotated[
+        int, typer.Option(..., help="Memory budget (bytes) for all write batches")
+    ] = settings.WRITE_MANY_MEMORY,
+    resume: Annotated[
+        Optional[bool],
+        typer.Option(..., help="Skip datasets finished by a previous (failed) run"),
+    ] = True,
+) -> None:
+    """
+    Write the sources of many datasets concurrently and report their throughput
+    """
+    state_path = get_state_path(manifest)
+    if not resume:
+        state_path.unlink(missing_ok=True)
+    results = write_many(
+        load_manifest(manifest),
+        concurrency=concurrency,
+        memory=memory,
+        state_path=state_path,
+    )
+    table = Table("dataset", "entities", "statements", "seconds", "statements/s")
+    for result in results:
+        elapsed = max(result["elapsed"], 0.001)
+        table.add_row(
+            result["dataset"],
+            str(result["entities"]),
+            str(result["statements"]),
+            f"{result['elapsed']:.2f}",
+            result["error"] or f"{result['statements'] / elapsed:.0f}",
+        )
+    print(table)
+    if any(r["error"] for r in results):
+        raise typer.Exit(1)
+
+
+@cli.command("benchmark")
+def cli_benchmark(
+    dataset: Annotated[str, typer.Option("-d", help="Dataset")],
+    samples: Annotated[int, typer.Option(..., help="Entity lookups")] = 100,
+) -> None:
+    """
+    Compare the operation profiles (lookup, export, ingest) with the client
+    defaults on a dataset
+    """
+    store = get_store(dataset=dataset)
+    table = Table("operation", "profile", "rows", "seconds", "speedup")
+    default = 0.0
+    for result in benchmark(store, dataset, samples):
+        if result["profile"] is None:
+            default = result["seconds"]
+        speedup = default / max(result["seconds"], 0.001)
+        table.add_row(
+            result["operation"],
+            result["profile"] or "(default)",
+            str(result["rows"]),
+            f"{result['seconds']:.2f}",
+            f"{speedup:.2f}x",
+        )
+    print(table)
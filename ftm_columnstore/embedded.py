@@ -0,0 +1,148 @@
+"""
+In-process ClickHouse engine via chDB with file-backed storage, for
+single-node analysis and tests without a running server. It is selected by
+the `chdb://` uri scheme:
+
+    chdb:///absolute/path/to/data
+    chdb://relative/path/to/data
+    chdb://                          (temporary storage)
+
+Query results are fully materialized, as chDB can't run other queries while
+streaming a result. Client settings profiles (`settings.PROFILES`) don't apply.
+"""
+
+import logging
+import re
+import time
+from collections.abc import Generator, Iterable, Iterator
+from itertools import islice
+from threading import RLock
+from typing import Any
+from uuid import uuid4
+
+import pandas as pd
+
+from ftm_columnstore import settings
+from ftm_columnstore.engine import ClickhouseEngine, get_compiled_query
+
+try:
+    from chdb import session
+except ImportError:
+    raise ImportError("Can not load EmbeddedClickhouseEngine. Install `chdb`")
+
+log = logging.getLogger(__name__)
+
+SCHEME = "chdb://"
+
+# merge tree settings that recent ClickHouse versions (as bundled with chDB)
+# require for the table definitions of `ClickhouseEngine`
+TABLE_SETTINGS = {
+    "ReplacingMergeTree": "deduplicate_merge_projection_mode = 'rebuild'",
+    "AggregatingMergeTree": "allow_dimensions_outside_sorting_key = 1",
+}
+
+
+def get_path(uri: str) -> str:
+    return uri[len(SCHEME) :]
+
+
+class Cursor:
+    def __init__(self, df: pd.DataFrame | None = None):
+        if df is None or df.empty:
+            self.rows: Iterator[tuple[Any, ...]] = iter(())
+        else:
+            df = df.astype(object).where(df.notna(), None)
+            self.rows = df.itertuples(index=False, name=None)
+
+    def __iter__(self) -> Iterator[tuple[Any, ...]]:
+        return self.rows
+
+    def fetchall(self) -> list[tuple[Any, ...]]:
+        return list(self.rows)
+
+    def fetchone(self) -> tuple[Any, ...] | None:
+        return next(self.rows, None)
+
+    def fetchmany(self, size: int) -> list[tuple[Any, ...]]:
+        return list(islice(self.rows, size))
+
+
+class Connection:
+    def __init__(self, engine: "EmbeddedClickhouseEngine"):
+        self.engine = engine
+
+    def __enter__(self) -> "Connection":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        pass
+
+    def execute(self, q: Any, *args: Any, **kwargs: Any) -> Cursor:
+        return Cursor(self.engine.query(q))
+
+    def execution_options(self, *args: Any, **kwargs: Any) -> "Connection":
+        return self
+
+
+class EmbeddedClickhouseEngine(ClickhouseEngine):
+    def __init__(self, uri: str | None = settings.DATABASE_URI):
+        self.session = session.Session(get_path(uri or settings.DATABASE_URI))
+        self.lock = RLock()
+        super().__init__(uri)
+
+    def query(self, q: Any) -> pd.DataFrame:
+        sql = get_compiled_query(q)
+        start = time.time()
+        with self.lock:
+            res = self.session.query(sql, "DataFrame")
+        self.log_query(uuid4().hex, sql, time.time() - start)
+        return res
+
+    def connect(
+        self, use_numpy: bool | None = False, profile: str | None = None
+    ) -> Connection:
+        return Connection(self)
+
+    def insert(
+        self,
+        df: pd.DataFrame,
+        table: str | None = None,
+        profile: str | None = "ingest",
+    ) -> int:
+        if df.empty:
+            return 0
+        table = table or self.table
+        columns = ", ".join(f"`{c}`" for c in df.columns)
+        # chDB resolves `Python(df)` to the local data frame
+        self.query(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM Python(df)")
+        return len(df)
+
+    def query_dataframe(self, query: Any, profile: str | None = None) -> pd.DataFrame:
+        return self.query(query)
+
+    def query_dataframes(
+        self,
+        query: Any,
+        chunksize: int | None = settings.BULK_WRITE_SIZE,
+        profile: str | None = "export",
+    ) -> Generator[pd.DataFrame, None, None]:
+        chunksize = chunksize or settings.BULK_WRITE_SIZE
+        df = self.query(query)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start : start + chunksize].reset_index(drop=True)
+
+    @property
+    def create_statements(self) -> Iterable[str]:
+        for stmt in super().create_statements:
+            for engine, table_settings in TABLE_SETTINGS.items():
+                if f"ENGINE = {engine}" in stmt:
+                    stmt = re.sub(
+                        r"(ORDER BY \([^)]*\))",
+                        rf"\1 SETTINGS {table_settings}",
+                        stmt,
+                        count=1,
+                    )
+            yield stmt
@@ -1,17 +1,40 @@
 import logging
-from collections.abc import Iterable
+import time
+from collections import defaultdict, deque
+from collections.abc import Generator, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import cache
-from typing import Any
+from itertools import islice
+from queue import Empty, LifoQueue
+from typing import Any, TypedDict, cast
+from urllib.parse import urlencode
+from uuid import uuid4
 
 import pandas as pd
 from clickhouse_driver import Client, dbapi
+from clickhouse_driver.compression import get_compressor_cls
+from clickhouse_driver.errors import (
+    ErrorCodes,
+    ServerException,
+    UnknownCompressionMethod,
+)
 from nomenklatura.settings import STATEMENT_TABLE
-from sqlalchemy import Select
+from sqlalchemy.sql.selectable import Select
 
 from ftm_columnstore import settings
 
 log = logging.getLogger(__name__)
 
+RETRY_CODES = (
+    ErrorCodes.TOO_MANY_PARTS,
+    ErrorCodes.MEMORY_LIMIT_EXCEEDED,
+    ErrorCodes.TOO_MANY_SIMULTANEOUS_QUERIES,
+)
+
+# table comment of completely populated derived tables
+BACKFILLED = "backfilled"
+
 
 def table_exists(e: Exception, table: str) -> bool:
     if f"Table default.{table} already exists" in str(e):
@@ -21,30 +44,79 @@ def table_exists(e: Exception, table: str) -> bool:
     return False
 
 
+@cache
+def check_compression(method: str) -> None:
+    try:
+        get_compressor_cls(method)
+    except UnknownCompressionMethod:
+        extra = "zstd" if method == "zstd" else "lz4"
+        raise ImportError(
+            f"Can not use `{method}` compression. Install `clickhouse-driver[{extra}]`"
+            " or set `COMPRESSION=` to disable it"
+        )
+
+
 def get_compiled_query(q: Any) -> str:
     # FIXME: this is dangerous!
     if hasattr(q, "compile"):
         q = str(q.compile(compile_kwargs={"literal_binds": True}))
         q = q.replace("group_concat", "first_value")
-    q = str(q)
-    log.debug(q)
-    return q
+    sql = str(q)
+    log.debug(sql)
+    return sql
+
+
+class SlowQuery(TypedDict):
+    query_id: str
+    query: str
+    elapsed: float
 
 
 class Connection(dbapi.Connection):
     stream: bool = False
+    engine: "ClickhouseEngine | None" = None
 
-    def execute(self, q: Any, *args, **kwargs) -> dbapi.cursor.Cursor:
+    def execute(self, q: Any, *args: Any, **kwargs: Any) -> dbapi.cursor.Cursor:
         cursor = self.cursor()
         q = get_compiled_query(q)
+        query_id = uuid4().hex
+        cursor.set_query_id(query_id)
+        start = time.time()
         cursor.execute(q, *args, **kwargs)
+        if self.engine is not None:
+            self.engine.log_query(query_id, q, time.time() - start)
         return cursor
 
-    def execution_options(self, *args, **kwargs) -> "Connection":
+    def execution_options(self, *args: Any, **kwargs: Any) -> "Connection":
         self.stream = kwargs.get("stream_results", False)
         return self
 
 
+# statement columns within an entity snapshot
+SNAPSHOT_COLUMNS = {
+    "id": "String",
+    "entity_id": "String",
+    "prop": "String",
+    "prop_type": "String",
+    "schema": "String",
+    "value": "String",
+    "original_value": "Nullable(String)",
+    "lang": "String",
+    "target": "Boolean",
+    "external": "Boolean",
+    "first_seen": "Nullable(DateTime64)",
+}
+
+
+class PartitionInfo(TypedDict):
+    table: str
+    partition_id: str
+    partition: str
+    parts: int
+    rows: int
+    bytes: int
+
+
 class ClickhouseDialect:
     name = "postgres"
 
@@ -59,31 +131,132 @@ class ClickhouseEngine:
         self.table = STATEMENT_TABLE
         self.table_fpx = f"{self.table}_fpx"
         self.table_xref = f"{self.table}_xref"
+        self.table_edges = f"{self.table}_edges"
         self.view_stats = f"{self.table}_stats"
         self.view_fpx_freq = f"{self.table}_fpx_freq"
+        self.view_edges = f"{self.table}_edges_mv"
+        self.table_entities = f"{self.table}_entities"
+        self.view_entities = f"{self.table}_entities_mv"
         self.tables = (
             self.table,
             self.table_fpx,
             self.table_xref,
+            self.table_edges,
             self.view_stats,
             self.view_fpx_freq,
+            self.view_edges,
+            self.table_entities,
+            self.view_entities,
+        )
+        self.uri = uri or settings.DATABASE_URI
+        self.snapshots = settings.ENTITY_SNAPSHOTS
+        self.slow_query_threshold = settings.SLOW_QUERY_THRESHOLD
+        self.slow_queries: deque[SlowQuery] = deque(maxlen=settings.SLOW_QUERY_LOG_SIZE)
+        self.fpx_max_freq = settings.FPX_MAX_FREQ
+        self.stop_tokens: frozenset[str] = frozenset()
+        self.stop_tokens_updated = 0.0
+        self.backfilled: frozenset[str] = frozenset()
+        self.backfilled_updated = 0.0
+        self.profiles = {k: dict(v) for k, v in settings.PROFILES.items()}
+        self.pools: dict[str | None, LifoQueue[Client]] = defaultdict(
+            lambda: LifoQueue(settings.CONNECTION_POOL_SIZE)
         )
-        self.uri = uri
         self.ensure(recreate=False, exists_ok=True)
 
-    def __str__(self):
+    def __str__(self) -> str:
         return self.uri
 
-    def __repr__(self):
+    def __repr__(self) -> str:
         return f"<{self.__class__.__name__} ({self})>"
 
-    def connect(self, use_numpy: bool | None = False) -> dbapi.Connection | Client:
+    def get_uri(
+        self, use_numpy: bool | None = False, profile: str | None = None
+    ) -> str:
+        """
+        Get the connection uri with the client settings of the given operation
+        profile (see `settings.PROFILES`)
+        """
+        params: dict[str, str] = {}
         if use_numpy:
-            uri = self.uri + "?use_numpy=True"
-            return Client.from_url(uri)
-        return Connection(self.uri)
+            params["use_numpy"] = "True"
+        if profile is not None:
+            # empty values (e.g. `compression`) mean client defaults
+            params.update({k: v for k, v in self.profiles[profile].items() if v})
+            if "compression" in params:
+                check_compression(params["compression"])
+        if not params:
+            return self.uri
+        sep = "&" if "?" in self.uri else "?"
+        return f"{self.uri}{sep}{urlencode(params)}"
+
+    def connect(
+        self, use_numpy: bool | None = False, profile: str | None = None
+    ) -> dbapi.Connection | Client:
+        if use_numpy:
+            return Client.from_url(self.get_uri(use_numpy, profile))
+        conn = Connection(self.get_uri(profile=profile))
+        conn.engine = self
+        return conn
 
-    def ensure(self, recreate: bool | None = False, exists_ok: bool | None = False):
+    @contextmanager
+    def client(self, profile: str | None = None) -> Generator[Client, None, None]:
+        """
+        Get a (numpy) client for the given operation profile from the
+        connection pool, shared by all users of this engine (e.g. concurrent
+        writers), for complete operations only (not for streaming results)
+        """
+        pool = self.pools[profile]
+        try:
+            client = pool.get_nowait()
+        except Empty:
+            client = self.connect(use_numpy=True, profile=profile)
+        try:
+            yield client
+        except Exception as e:
+            client.disconnect()
+            raise e
+        if pool.full():
+            client.disconnect()
+        else:
+            pool.put_nowait(client)
+
+    def log_query(self, query_id: str, query: str, elapsed: float) -> None:
+        """
+        Keep queries slower than `slow_query_threshold` (seconds) for
+        `ftm_columnstore.explain`
+        """
+        if elapsed >= self.slow_query_threshold:
+            log.warning(f"Slow query `{query_id}` ({elapsed:.2f}s)")
+            self.slow_queries.append(
+                SlowQuery(query_id=query_id, query=query, elapsed=elapsed)
+            )
+
+    def get_stop_tokens(self, refresh: bool | None = False) -> frozenset[str]:
+        """
+        Get the fingerprint tokens that occur more than `fpx_max_freq` times
+        according to `view_fpx_freq`, refreshed every
+        `FPX_STOP_TOKENS_REFRESH` seconds
+        """
+        if not self.fpx_max_freq:
+            return frozenset()
+        age = time.time() - self.stop_tokens_updated
+        if refresh or age > settings.FPX_STOP_TOKENS_REFRESH:
+            with self.connect() as conn:
+                cursor = conn.execute(
+                    f"""SELECT value FROM {self.view_fpx_freq} GROUP BY value
+                    HAVING countMerge(freq) > {self.fpx_max_freq}"""
+                )
+                stop_tokens = frozenset(row[0] for row in cursor.fetchall())
+            if stop_tokens != self.stop_tokens:
+                log.info(f"{len(stop_tokens)} fingerprint stop tokens.")
+                # keep the same object for the fingerprint caches
+                self.stop_tokens = stop_tokens
+            self.stop_tokens_updated = time.time()
+        return self.stop_tokens
+
+    def ensure(
+        self, recreate: bool | None = False, exists_ok: bool | None = False
+    ) -> None:
         with self.connect() as conn:
             if recreate:
                 for stmt in self.drop_statements:
@@ -96,33 +269,264 @@ class ClickhouseEngine:
                         pass
                     else:
                         raise e
+            # derived tables of an empty store are complete right away
+            pending = set(self.derived_tables) - self.get_backfilled(refresh=True)
+            if pending:
+                cursor = conn.execute(f"SELECT count() FROM {self.table}")
+                if not cursor.fetchone()[0]:
+                    for table in pending:
+                        conn.execute(
+                            f"ALTER TABLE {table} MODIFY COMMENT '{BACKFILLED}'"
+                        )
+                    self.get_backfilled(refresh=True)
             # self.execute("GRANT ALL ON *.* TO CURRENT_USER WITH GRANT OPTION")
 
-    def insert(self, df: pd.DataFrame, table: str | None = None) -> int:
+    @property
+    def derived_tables(self) -> dict[str, str]:
+        """
+        The tables populated from statements by materialized views and their
+        view queries
+        """
+        tables = {self.table_edges: self.edges_query}
+        if self.snapshots:
+            tables[self.table_entities] = self.get_snapshot_query()
+        return tables
+
+    def get_backfilled(self, refresh: bool | None = False) -> frozenset[str]:
+        """
+        Get the derived tables that are completely populated (see `backfill`),
+        refreshed every `BACKFILL_REFRESH` seconds while some are not
+        """
+        pending = set(self.derived_tables) - self.backfilled
+        age = time.time() - self.backfilled_updated
+        if refresh or (pending and age > settings.BACKFILL_REFRESH):
+            with self.connect() as conn:
+                cursor = conn.execute(
+                    f"""SELECT name FROM system.tables
+                    WHERE database = currentDatabase() AND comment = '{BACKFILLED}'"""
+                )
+                self.backfilled = frozenset(row[0] for row in cursor.fetchall())
+            self.backfilled_updated = time.time()
+        return self.backfilled
+
+    @property
+    def edges(self) -> str:
+        """
+        The edge table once it is populated, the entity statements otherwise
+        """
+        if self.table_edges in self.get_backfilled():
+            return self.table_edges
+        return f"({self.edges_query})"
+
+    def insert(
+        self,
+        df: pd.DataFrame,
+        table: str | None = None,
+        profile: str | None = "ingest",
+    ) -> int:
         # https://clickhouse-driver.readthedocs.io/en/latest/features.html#numpy-pandas-support
         if df.empty:
             return 0
         table = table or self.table
-        with self.connect(use_numpy=True) as conn:
-            return conn.insert_dataframe("INSERT INTO %s VALUES" % table, df)
-
-    def query_dataframe(self, query: Select) -> pd.DataFrame:
-        query = get_compiled_query(query)
-        with self.get_connection() as conn:
-            return conn.query_dataframe(query)
-
-    def sync(self):  # somehow not guaranteed by clickhouse
+        attempt = 0
+        while True:
+            try:
+                with self.client(profile) as client:
+                    rows: int = client.insert_dataframe(
+                        "INSERT INTO %s VALUES" % table, df
+                    )
+                    return rows
+            except ServerException as e:
+                if e.code not in RETRY_CODES or attempt == settings.WRITE_RETRIES:
+                    raise e
+                delay = settings.WRITE_BACKOFF * 2**attempt
+                log.warning(
+                    f"Insert into `{table}` failed (code {e.code}), "
+                    f"retrying in {delay}s ..."
+                )
+                time.sleep(delay)
+                if e.code == ErrorCodes.MEMORY_LIMIT_EXCEEDED and len(df) > 1:
+                    # split the batch to lower memory pressure on the server
+                    half = len(df) // 2
+                    return self.insert(df.iloc[:half], table, profile) + self.insert(
+                        df.iloc[half:], table, profile
+                    )
+                attempt += 1
+
+    def query_dataframe(
+        self, query: Select | str, profile: str | None = None
+    ) -> pd.DataFrame:
+        sql = get_compiled_query(query)
+        query_id = uuid4().hex
+        start = time.time()
+        with self.client(profile) as client:
+            df = client.query_dataframe(sql, query_id=query_id)
+        self.log_query(query_id, sql, time.time() - start)
+        return df
+
+    def query_dataframes(
+        self,
+        query: Select | str,
+        chunksize: int | None = settings.BULK_WRITE_SIZE,
+        profile: str | None = "export",
+    ) -> Generator[pd.DataFrame, None, None]:
+        """Stream the result of `query` as data frames of `chunksize` rows"""
+        sql = get_compiled_query(query)
+        with self.connect(use_numpy=True, profile=profile) as conn:
+            rows = conn.execute_iter(
+                sql,
+                with_column_types=True,
+                settings={"max_block_size": chunksize},
+            )
+            columns = [c for c, _ in next(rows, [])]
+            while chunk := list(islice(rows, chunksize)):
+                yield pd.DataFrame.from_records(chunk, columns=columns)
+
+    def sync(self) -> None:  # somehow not guaranteed by clickhouse
         with self.connect() as conn:
             conn.execute(f"OPTIMIZE TABLE {self.table} FINAL DEDUPLICATE")
 
-    def optimize(self, full: bool | None = False):
+    def optimize(
+        self, full: bool | None = False, incremental: bool | None = False
+    ) -> list[PartitionInfo]:
         with self.connect() as conn:
             for table in (self.view_stats, self.view_fpx_freq):
                 log.info(f"Optimizing `{table}` ...")
                 conn.execute(f"OPTIMIZE TABLE {table} FINAL")
+        if incremental:
+            return self.optimize_partitions()
         if full:
             log.info(f"Optimizing `{self.table}` ...")
             self.sync()
+        return []
+
+    def backfill(self) -> None:
+        """
+        Populate derived tables from already existing statements
+        """
+        self.rebuild(self.table_edges, self.edges_query, [self.edges_query])
+        if self.snapshots:
+            with self.connect() as conn:
+                cursor = conn.execute(f"SELECT DISTINCT dataset FROM {self.table}")
+                datasets = [row[0] for row in cursor.fetchall()]
+            queries = [
+                self.get_snapshot_query(f"WHERE dataset = '{d}'") for d in datasets
+            ]
+            self.rebuild(self.table_entities, self.get_snapshot_query(), queries)
+
+    def rebuild(self, table: str, view_query: str, queries: Iterable[str]) -> None:
+        """
+        Populate the derived `table` from `queries` into a staging table that
+        is swapped in when complete, so that readers never see a partial
+        table. Statements written meanwhile reach the staging table via a
+        temporary materialized view with `view_query`, duplicates are merged
+        away by the table engine.
+        """
+        staging = f"{table}_staging"
+        view = f"{staging}_mv"
+        log.info(f"Populating `{table}` ...")
+        with self.connect() as conn:
+            conn.execute(f"DROP VIEW IF EXISTS {view}")
+            conn.execute(f"DROP TABLE IF EXISTS {staging}")
+            conn.execute(f"CREATE TABLE {staging} AS {table}")
+            conn.execute(
+                f"CREATE MATERIALIZED VIEW {view} TO {staging} AS {view_query}"
+            )
+            try:
+                for query in queries:
+                    conn.execute(f"INSERT INTO {staging} {query}")
+                conn.execute(f"EXCHANGE TABLES {staging} AND {table}")
+                conn.execute(f"ALTER TABLE {table} MODIFY COMMENT '{BACKFILLED}'")
+            finally:
+                conn.execute(f"DROP VIEW {view}")
+                conn.execute(f"DROP TABLE {staging}")
+        self.get_backfilled(refresh=True)
+
+    @property
+    def edges_query(self) -> str:
+        return f"""SELECT canonical_id, prop, value, dataset, schema
+        FROM {self.table} WHERE prop_type = 'entity'"""
+
+    def get_snapshot_query(self, where: str | None = "") -> str:
+        statement = ", ".join(SNAPSHOT_COLUMNS)
+        return f"""SELECT canonical_id, dataset,
+            groupUniqArray(({statement})) AS statements,
+            max(last_seen) AS last_seen
+        FROM {self.table} {where}
+        GROUP BY canonical_id, dataset"""
+
+    def get_partitions(
+        self, min_parts: int | None = settings.OPTIMIZE_MIN_PARTS
+    ) -> list[PartitionInfo]:
+        """
+        Get the partitions of the statement, fingerprint, xref and edge tables
+        that are fragmented into at least `min_parts` active parts and therefore may
+        contain duplicates (inserted parts are deduplicated already via
+        `optimize_on_insert`), most fragmented first.
+        """
+        tables = [self.table, self.table_fpx, self.table_xref, self.table_edges]
+        if self.snapshots:
+            tables.append(self.table_entities)
+        names = ", ".join(f"'{t}'" for t in tables)
+        query = f"""SELECT
+            table, partition_id, partition,
+            count() AS parts,
+            sum(rows) AS rows, sum(bytes_on_disk) AS bytes
+        FROM system.parts
+        WHERE database = currentDatabase() AND active AND table IN ({names})
+        GROUP BY table, partition_id, partition
+        HAVING parts >= {min_parts}
+        ORDER BY parts DESC, bytes ASC"""
+        with self.connect() as conn:
+            cursor = conn.execute(query)
+            return [
+                cast(PartitionInfo, dict(zip(PartitionInfo.__annotations__, row)))
+                for row in cursor.fetchall()
+            ]
+
+    def optimize_partition(self, partition: PartitionInfo) -> PartitionInfo:
+        log.info(
+            f"Optimizing `{partition['table']}` partition "
+            f"`{partition['partition']}` ({partition['parts']} parts) ..."
+        )
+        with self.connect() as conn:
+            conn.execute(
+                f"OPTIMIZE TABLE {partition['table']} "
+                f"PARTITION ID '{partition['partition_id']}' FINAL DEDUPLICATE"
+            )
+        return partition
+
+    def optimize_partitions(
+        self,
+        concurrency: int | None = settings.OPTIMIZE_CONCURRENCY,
+        timeout: int | None = settings.OPTIMIZE_TIMEOUT,
+        min_parts: int | None = settings.OPTIMIZE_MIN_PARTS,
+    ) -> list[PartitionInfo]:
+        """
+        Optimize only the partitions that need it instead of the whole
+        tables, running at most `concurrency` optimizations at once. No new
+        optimizations are started after `timeout` seconds.
+        """
+        concurrency = concurrency or settings.OPTIMIZE_CONCURRENCY
+        timeout = timeout or settings.OPTIMIZE_TIMEOUT
+        min_parts = min_parts or settings.OPTIMIZE_MIN_PARTS
+        deadline = time.time() + timeout
+
+        def _optimize(partition: PartitionInfo) -> PartitionInfo | None:
+            if time.time() > deadline:
+                return None
+            return self.optimize_partition(partition)
+
+        partitions = self.get_partitions(min_parts)
+        log.info(f"{len(partitions)} partitions to optimize.")
+        with ThreadPoolExecutor(concurrency) as pool:
+            done = [p for p in pool.map(_optimize, partitions) if p is not None]
+        if len(done) < len(partitions):
+            log.warning(
+                f"Time budget exceeded, {len(partitions) - len(done)} "
+                "partitions left for the next run."
+            )
+        return done
 
     @property
     def create_statements(self) -> Iterable[str]:
@@ -150,6 +554,7 @@ class ClickhouseEngine:
             INDEX tix (prop_type) TYPE set(0) GRANULARITY 1,
             INDEX pix (prop) TYPE set(0) GRANULARITY 1
         ) ENGINE = ReplacingMergeTree(last_seen)
+        PARTITION BY dataset
         PRIMARY KEY (canonical_id, entity_id, prop, value, id)
         ORDER BY (canonical_id, entity_id, prop, value, id)
         """
@@ -169,6 +574,7 @@ class ClickhouseEngine:
             INDEX tix (prop_type) TYPE set(0) GRANULARITY 1,
             INDEX pix (prop) TYPE set(0) GRANULARITY 1
         ) ENGINE = ReplacingMergeTree()
+        PARTITION BY dataset
         PRIMARY KEY (algorithm,value,prop,schema,dataset)
         ORDER BY (algorithm,value,prop,schema,dataset,entity_id)
         """
@@ -233,6 +639,45 @@ class ClickhouseEngine:
         GROUP BY value
         """
 
+        create_table_edges = f"""
+        CREATE TABLE {self.table_edges}
+        (
+            `canonical_id`            String,
+            `prop`                    LowCardinality(String),
+            `value`                   String,
+            `dataset`                 LowCardinality(String),
+            `schema`                  LowCardinality(String)
+        ) ENGINE = ReplacingMergeTree()
+        PARTITION BY dataset
+        PRIMARY KEY (canonical_id, prop, value)
+        ORDER BY (canonical_id, prop, value, dataset, schema)
+        """
+
+        create_view_edges = f"""
+        CREATE MATERIALIZED VIEW {self.view_edges} TO {self.table_edges}
+        AS {self.edges_query}
+        """
+
+        statement = ", ".join(f"{c} {t}" for c, t in SNAPSHOT_COLUMNS.items())
+        create_table_entities = f"""
+        CREATE TABLE {self.table_entities}
+        (
+            `canonical_id`  String,
+            `dataset`       LowCardinality(String),
+            `statements`    SimpleAggregateFunction(
+                                groupUniqArrayArray, Array(Tuple({statement}))
+                            ),
+            `last_seen`     SimpleAggregateFunction(max, DateTime64)
+        ) ENGINE = AggregatingMergeTree()
+        PARTITION BY dataset
+        ORDER BY (canonical_id, dataset)
+        """
+
+        create_view_entities = f"""
+        CREATE MATERIALIZED VIEW {self.view_entities} TO {self.table_entities}
+        AS {self.get_snapshot_query()}
+        """
+
         projections = (
             f"""ALTER TABLE {self.table} ADD PROJECTION {self.table}_dataset (
                 SELECT * ORDER BY dataset,canonical_id,prop)""",
@@ -259,28 +704,43 @@ class ClickhouseEngine:
             f"""ALTER TABLE {self.table_xref} ADD PROJECTION {self.table_xref}_reverse (
                 SELECT * ORDER BY
             right_dataset,right_schema,right_id,left_dataset,left_schema,left_id)""",
+            f"""ALTER TABLE {self.table_edges} ADD PROJECTION {self.table_edges}_reverse (
+                SELECT * ORDER BY value,prop,canonical_id)""",
         )
-        return (
+        statements: tuple[str, ...] = (
             create_table,
             create_table_fpx,
             create_table_xref,
             create_view_stats,
             create_view_fpx_freq,
+            create_table_edges,
+            create_view_edges,
             *projections,
         )
+        if self.snapshots:
+            statements = (*statements, create_table_entities, create_view_entities)
+        return statements
 
     @property
-    def drop_statements(self) -> str:
+    def drop_statements(self) -> tuple[str, ...]:
         return (
             f"DROP TABLE IF EXISTS {self.table}",
             f"DROP TABLE IF EXISTS {self.table_fpx}",
             f"DROP TABLE IF EXISTS {self.table_xref}",
             f"DROP VIEW IF EXISTS {self.view_stats}",
             f"DROP VIEW IF EXISTS {self.view_fpx_freq}",
+            f"DROP VIEW IF EXISTS {self.view_edges}",
+            f"DROP TABLE IF EXISTS {self.table_edges}",
+            f"DROP VIEW IF EXISTS {self.view_entities}",
+            f"DROP TABLE IF EXISTS {self.table_entities}",
         )
 
 
 @cache
 def get_engine(uri: str | None = None) -> ClickhouseEngine:
     uri = uri or settings.DATABASE_URI
+    if uri.startswith("chdb://"):
+        from ftm_columnstore.embedded import EmbeddedClickhouseEngine
+
+        return EmbeddedClickhouseEngine(uri)
     return ClickhouseEngine(uri)
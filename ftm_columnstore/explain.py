@@ -0,0 +1,195 @@
+"""
+Find query patterns that scan the statement table instead of using its
+primary key or projections.
+
+Queries come from the slow-query log of an engine (`engine.slow_queries`,
+queries above `SLOW_QUERY_THRESHOLD`) or from the server `system.query_log`.
+Each query is explained via `EXPLAIN indexes = 1, projections = 1` and joined
+with its `system.query_log` stats (read rows and bytes, memory, used
+projections) if the server keeps a query log (chDB doesn't).
+"""
+
+import logging
+import re
+from collections.abc import Iterable
+from datetime import datetime
+from typing import Any, TypedDict, cast
+
+from ftm_columnstore.changes import get_since
+from ftm_columnstore.engine import ClickhouseEngine, SlowQuery, get_engine
+from ftm_columnstore.settings import SLOW_QUERY_THRESHOLD
+
+log = logging.getLogger(__name__)
+
+EXPLAINABLE = ("SELECT", "WITH")
+
+
+class Explain(TypedDict):
+    tables: list[str]
+    projections: list[str]
+    granules: int
+    granules_total: int
+    full_scan: bool
+    plan: str
+
+
+class QueryReport(TypedDict):
+    query_id: str
+    query: str
+    elapsed: float
+    read_rows: int | None
+    read_bytes: int | None
+    memory_usage: int | None
+    projections: list[str]
+    tables: list[str]
+    granules: int
+    granules_total: int
+    full_scan: bool
+    plan: str
+
+
+def parse_explain(plan: str) -> Explain:
+    """
+    Get the tables and projections read, the primary key granules selected out
+    of the total and whether any table is read without using its primary key
+    (no key condition or all of its granules selected)
+    """
+    tables, projections, granules, granules_total, full_scan = [], [], 0, 0, False
+    block, name = None, None
+    for line in plan.splitlines():
+        line = line.strip(" │└─")
+        if m := re.match(r"ReadFromMergeTree \((.+)\)", line):
+            # tables are read as `database.table`, projections by their name
+            if "." in m[1]:
+                tables.append(m[1])
+            else:
+                projections.append(m[1])
+            block = None
+        elif line in ("PrimaryKey", "Projections:"):
+            block = line
+        elif block == "PrimaryKey" and line == "Condition: true":
+            full_scan = True
+        elif block == "PrimaryKey" and (m := re.match(r"Granules: (\d+)/(\d+)", line)):
+            selected, total = int(m[1]), int(m[2])
+            granules += selected
+            granules_total += total
+            full_scan = full_scan or (total > 0 and selected == total)
+            block = None
+        elif block == "Projections:" and (m := re.match(r"Name: (.+)", line)):
+            name = m[1]
+        elif block == "Projections:" and line.startswith("Description:"):
+            # candidates that are not better than the table are listed, too
+            if name is not None and " is used" in line:
+                projections.append(name)
+    return Explain(
+        tables=tables,
+        projections=projections,
+        granules=granules,
+        granules_total=granules_total,
+        full_scan=full_scan,
+        plan=plan,
+    )
+
+
+def explain(query: str, engine: ClickhouseEngine | None = None) -> Explain:
+    engine = engine or get_engine()
+    with engine.connect() as conn:
+        cursor = conn.execute(f"EXPLAIN indexes = 1, projections = 1 {query}")
+        plan = "\n".join(row[0] for row in cursor.fetchall())
+    return parse_explain(plan)
+
+
+def get_query_stats(
+    query_ids: Iterable[str], engine: ClickhouseEngine | None = None
+) -> dict[str, dict[str, Any]]:
+    """
+    Get read rows, read bytes, memory usage and used projections of finished
+    queries from `system.query_log`
+    """
+    engine = engine or get_engine()
+    query_ids = ", ".join(f"'{i}'" for i in query_ids)
+    if not query_ids:
+        return {}
+    columns = ("read_rows", "read_bytes", "memory_usage", "projections")
+    try:
+        with engine.connect() as conn:
+            conn.execute("SYSTEM FLUSH LOGS")
+            cursor = conn.execute(
+                f"""SELECT query_id, {", ".join(columns)} FROM system.query_log
+                WHERE type = 'QueryFinish' AND query_id IN ({query_ids})"""
+            )
+            return {row[0]: dict(zip(columns, row[1:])) for row in cursor.fetchall()}
+    except Exception as e:
+        log.warning(f"Can not read `system.query_log`: {e}")
+        return {}
+
+
+def get_slow_queries(
+    engine: ClickhouseEngine | None = None,
+    threshold: float | None = SLOW_QUERY_THRESHOLD,
+    since: datetime | str | None = None,
+    limit: int | None = 100,
+) -> list[SlowQuery]:
+    """
+    Get the slowest select queries on the store tables from `system.query_log`
+    """
+    engine = engine or get_engine()
+    if threshold is None:
+        threshold = SLOW_QUERY_THRESHOLD
+    tables = ", ".join(f"concat(currentDatabase(), '.{t}')" for t in engine.tables)
+    where = ""
+    if since is not None:
+        where = f"AND event_time >= {get_since(since)}"
+    try:
+        with engine.connect() as conn:
+            conn.execute("SYSTEM FLUSH LOGS")
+            cursor = conn.execute(
+                f"""SELECT query_id, query, query_duration_ms / 1000 AS elapsed
+                FROM system.query_log
+                WHERE type = 'QueryFinish' AND query_kind = 'Select'
+                AND hasAny(tables, [{tables}])
+                AND query_duration_ms >= {threshold * 1000} {where}
+                ORDER BY elapsed DESC LIMIT {limit}"""
+            )
+            return [
+                cast(SlowQuery, dict(zip(SlowQuery.__annotations__, row)))
+                for row in cursor.fetchall()
+            ]
+    except Exception as e:
+        log.warning(f"Can not read `system.query_log`: {e}")
+        return []
+
+
+def get_report(
+    queries: Iterable[SlowQuery], engine: ClickhouseEngine | None = None
+) -> list[QueryReport]:
+    """
+    Explain the given queries and rank them by read rows (if known), full
+    scans and latency
+    """
+    engine = engine or get_engine()
+    queries = [
+        q for q in queries if q["query"].lstrip().upper().startswith(EXPLAINABLE)
+    ]
+    stats = get_query_stats([q["query_id"] for q in queries], engine)
+    reports: list[QueryReport] = []
+    for query in queries:
+        query_stats = stats.get(query["query_id"], {})
+        res = explain(query["query"], engine)
+        # the projections the query actually read, if known
+        if query_stats.get("projections"):
+            res["projections"] = list(query_stats["projections"])
+        reports.append(
+            QueryReport(
+                **query,
+                read_rows=query_stats.get("read_rows"),
+                read_bytes=query_stats.get("read_bytes"),
+                memory_usage=query_stats.get("memory_usage"),
+                **res,
+            )
+        )
+    return sorted(
+        reports,
+        key=lambda r: (r["read_rows"] or 0, r["full_scan"], r["elapsed"]),
+        reverse=True,
+    )
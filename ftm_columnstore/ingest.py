@@ -0,0 +1,146 @@
+"""
+Concurrent ingest of many datasets, e.g. for nightly loads.
+
+A manifest (yaml or json) lists the sources to write per dataset:
+
+    sources:
+      - dataset: eu_authorities
+        uri: s3://data/eu_authorities/entities.ftm.json
+      - dataset: donations
+        uri:
+          - ./donations_2023.ijson
+          - ./donations_2024.ijson
+
+Datasets are written by `concurrency` threads. They share the engine and its
+connection pool as well as the (process wide) fingerprint and phonetic caches,
+and the write batches of all of them stay within the `memory` budget.
+
+Finished datasets are recorded in a state file next to the manifest, so a
+failed run can be resumed with the unfinished datasets only. Re-writing a
+dataset is safe, as statements are deduplicated by their id.
+"""
+
+import json
+import logging
+import time
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import TypedDict
+
+import yaml
+from ftmq.io import smart_read_proxies
+
+from ftm_columnstore.settings import WRITE_MANY_CONCURRENCY, WRITE_MANY_MEMORY
+from ftm_columnstore.store import get_store
+
+log = logging.getLogger(__name__)
+
+
+class Source(TypedDict):
+    dataset: str
+    uri: str | list[str]
+
+
+class IngestResult(TypedDict):
+    dataset: str
+    entities: int
+    statements: int
+    elapsed: float
+    error: str | None
+
+
+def load_manifest(path: Path) -> list[Source]:
+    with open(path) as fh:
+        data = yaml.safe_load(fh)
+    if isinstance(data, dict):
+        data = data["sources"]
+    return [Source(dataset=s["dataset"], uri=s["uri"]) for s in data]
+
+
+def get_state_path(path: Path) -> Path:
+    return path.with_suffix(".state.json")
+
+
+def load_state(path: Path) -> dict[str, IngestResult]:
+    if not path.exists():
+        return {}
+    with open(path) as fh:
+        state: dict[str, IngestResult] = json.load(fh)
+    return state
+
+
+def write_dataset(
+    source: Source, uri: str | None = None, max_batch_bytes: int | None = None
+) -> IngestResult:
+    store = get_store(dataset=source["dataset"], uri=uri)
+    entities = 0
+    start = time.time()
+    writer = store.writer(max_batch_bytes)
+    with writer:
+        for proxy in smart_read_proxies(source["uri"]):
+            writer.add_entity(proxy)
+            entities += 1
+    elapsed = time.time() - start
+    log.info(
+        f"Wrote {entities} entities ({writer.written} statements) to dataset "
+        f"`{source['dataset']}` in {elapsed:.2f}s."
+    )
+    return IngestResult(
+        dataset=source["dataset"],
+        entities=entities,
+        statements=writer.written,
+        elapsed=elapsed,
+        error=None,
+    )
+
+
+def write_many(
+    sources: Iterable[Source],
+    uri: str | None = None,
+    concurrency: int | None = WRITE_MANY_CONCURRENCY,
+    memory: int | None = WRITE_MANY_MEMORY,
+    state_path: Path | None = None,
+) -> list[IngestResult]:
+    """
+    Write the sources of multiple datasets concurrently and return the
+    results of this run (datasets already done according to the state file
+    are skipped). Failed datasets are reported with their `error`.
+    """
+    concurrency = concurrency or WRITE_MANY_CONCURRENCY
+    max_batch_bytes = (memory or WRITE_MANY_MEMORY) // concurrency
+    state = load_state(state_path) if state_path else {}
+    sources = [s for s in sources if s["dataset"] not in state]
+    if state:
+        log.info(f"Resuming, {len(state)} datasets done already.")
+    results: list[IngestResult] = []
+
+    def _write(source: Source) -> IngestResult:
+        try:
+            return write_dataset(source, uri, max_batch_bytes)
+        except Exception as e:
+            log.error(f"Writing dataset `{source['dataset']}` failed: {e}")
+            return IngestResult(
+                dataset=source["dataset"],
+                entities=0,
+                statements=0,
+                elapsed=0,
+                error=str(e),
+            )
+
+    # stores are not thread safe to initialize
+    for source in sources:
+        get_store(dataset=source["dataset"], uri=uri)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in as_completed(pool.submit(_write, s) for s in sources):
+            result = future.result()
+            results.append(result)
+            if state_path and result["error"] is None:
+                state[result["dataset"]] = result
+                with open(state_path, "w") as fh:
+                    json.dump(state, fh, indent=2)
+    if state_path and all(r["error"] is None for r in results):
+        # complete, start from scratch next time
+        state_path.unlink(missing_ok=True)
+    return results
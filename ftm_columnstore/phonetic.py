@@ -27,14 +27,19 @@ TPhoneticAlgorithm = Literal[
 ]
 
 DEFAULT_PHONETIC_ALGORITHM = PhoneticAlgorithm.fingerprint
+# single characters (initials) are no useful tokens
+MIN_TOKEN_LENGTH = 2
 
 
 @lru_cache(10_000_000)
-def tokenize(value: str) -> set[str]:
-    tokens = set()
+def tokenize(value: str) -> frozenset[str]:
+    """
+    Get the value itself and its words. Frequent words are excluded at write
+    time via the stop tokens (see `ClickhouseEngine.get_stop_tokens`).
+    """
+    tokens = {t for t in value.split(WS) if len(t) >= MIN_TOKEN_LENGTH}
     tokens.add(value)
-    tokens.update([t for t in value.split(WS) if len(t) > 5])  # FIXME
-    return tokens
+    return frozenset(tokens)
 
 
 @lru_cache(10_000_000)
@@ -43,7 +48,7 @@ def get_fingerprint(value: str) -> str:
 
 
 @lru_cache(10_000_000)
-def get_metaphone(value: str) -> tuple[str]:
+def get_metaphone(value: str) -> tuple[str, ...]:
     return tuple(x or "" for x in doublemetaphone(value))
 
 
@@ -54,12 +59,17 @@ def get_soundex(value: str) -> str:
 
 @lru_cache(10_000_000)
 def get_phonetics(
-    value: str, algorithm: TPhoneticAlgorithm | None = DEFAULT_PHONETIC_ALGORITHM
-) -> tuple[str]:
+    value: str,
+    algorithm: TPhoneticAlgorithm | None = DEFAULT_PHONETIC_ALGORITHM,
+    stop_tokens: frozenset[str] | None = None,
+) -> tuple[str, ...]:
     value = get_fingerprint(value)  # fingerprint always
     if not value:
         return ("",)
     tokens = tokenize(value)
+    if stop_tokens:
+        # always keep the full value
+        tokens = frozenset(t for t in tokens if t == value or t not in stop_tokens)
     if algorithm == PhoneticAlgorithm.fingerprint:
         return tuple(t for t in tokens)
     if algorithm == PhoneticAlgorithm.metaphone1:
@@ -68,13 +78,14 @@ def get_phonetics(
         return tuple(get_metaphone(t)[1] for t in tokens)
     if algorithm == PhoneticAlgorithm.soundex:
         return tuple(get_soundex(t) for t in tokens)
+    raise ValueError(f"Unknown phonetic algorithm: `{algorithm}`")
 
 
 def get_entity_fpx(
     entity: CE,
     algorithm: TPhoneticAlgorithm | None = DEFAULT_PHONETIC_ALGORITHM,
 ) -> set[str]:
-    values = set()
+    values: set[str] = set()
     for value in entity.get_type_values(registry.get("name")):
         values.update(get_phonetics(value, algorithm))
     for value in entity.get_type_values(registry.get("label")):
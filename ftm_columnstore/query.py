@@ -0,0 +1,304 @@
+"""
+ClickHouse specific compiler for `ftmq.Query` objects.
+
+Filters, sorting, pagination and aggregations are compiled into native
+ClickHouse SQL over the statement table, so that only final results are
+transferred:
+
+- property filters are combined per entity via `GROUP BY canonical_id HAVING
+  countIf(...)` in one scan
+- pagination is ordered by the primary key (`canonical_id`)
+- distinct counts use `uniqExact`
+- all aggregations of a query are computed in one scan via `-If` combinators,
+  and per grouping property in one query for all groups (instead of one query
+  per group)
+- aggregations read each statement once (`LIMIT 1 BY id`), so not yet merged
+  duplicate statement versions don't add up in sums and averages
+
+Queries filtering on `prop` are answered via the `_prop` projection of the
+statement table.
+"""
+
+from functools import cached_property
+from typing import Any
+
+from followthemoney.types import registry
+from ftmq.aggregations import Aggregation
+from ftmq.enums import Aggregations, Fields, PropertyTypesMap
+from ftmq.exceptions import ValidationError
+from ftmq.query import Query
+from ftmq.sql import Field, Sql
+from sqlalchemy import and_, or_, select
+
+from ftm_columnstore.engine import get_compiled_query
+
+NUMERIC = "toDecimal128OrNull(value, 10)"
+
+
+def _compile(clause: Any) -> str:
+    return get_compiled_query(clause)
+
+
+def _str(value: Any) -> str:
+    value = str(value).replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{value}'"
+
+
+class ClickhouseSql(Sql):
+    @cached_property
+    def name(self) -> str:
+        return str(self.table.name)
+
+    @cached_property
+    def columns(self) -> str:
+        return ", ".join(f"{self.name}.{c.name}" for c in self.table.columns)
+
+    @cached_property
+    def aggs(self) -> list[Aggregation]:
+        # fixed order of the (unordered) query aggregations
+        return list(self.q.aggregations)
+
+    @cached_property
+    def where(self) -> str:
+        # filters that apply to each statement of an entity
+        clauses = []
+        if self.q.ids:
+            clauses.append(
+                or_(
+                    *(
+                        self.get_expression(self.table.c[f.key], f)
+                        for f in sorted(self.q.ids)
+                    )
+                )
+            )
+        if self.q.datasets:
+            clauses.append(
+                or_(
+                    *(
+                        self.get_expression(self.table.c.dataset, f)
+                        for f in sorted(self.q.datasets)
+                    )
+                )
+            )
+        if self.q.schemata:
+            clauses.append(
+                or_(
+                    *(
+                        self.get_expression(self.table.c.schema, f)
+                        for f in sorted(self.q.schemata)
+                    )
+                )
+            )
+        if self.q.reversed:
+            rclause = or_(
+                *(
+                    and_(
+                        self.table.c.prop_type == str(registry.entity),
+                        self.get_expression(self.table.c.value, f),
+                    )
+                    for f in sorted(self.q.reversed)
+                )
+            )
+            rq = select(self.table.c.canonical_id.distinct()).where(
+                and_(rclause, *clauses)
+            )
+            clauses.append(self.table.c.canonical_id.in_(rq))
+        if not clauses:
+            return "1"
+        return _compile(and_(*clauses))
+
+    @cached_property
+    def filters(self) -> list[str]:
+        # filters that need to match at least one statement of an entity
+        filters = [
+            _compile(
+                and_(
+                    self.table.c.prop == f.key,
+                    self.get_expression(self.table.c.value, f),
+                )
+            )
+            for f in sorted(self.q.properties)
+        ]
+        if self.q.search_filters:
+            filters.append(_compile(self.search_clause))
+        return filters
+
+    @cached_property
+    def all_canonical_ids(self) -> str:
+        q = f"SELECT canonical_id FROM {self.name} WHERE {self.where}"
+        if self.filters:
+            having = " AND ".join(f"countIf({f}) > 0" for f in self.filters)
+            q += f" AND ({' OR '.join(self.filters)})"
+            return f"{q} GROUP BY canonical_id HAVING {having}"
+        return f"{q} GROUP BY canonical_id"
+
+    @cached_property
+    def canonical_ids(self) -> str:
+        q = f"{self.all_canonical_ids} ORDER BY canonical_id"
+        if self.q.sort is None:
+            q += self.limit
+        return q
+
+    @cached_property
+    def limit(self) -> str:
+        if self.q.limit is None:
+            return ""
+        return f" LIMIT {self.q.limit} OFFSET {self.q.offset or 0}"
+
+    @cached_property
+    def scope(self) -> str:
+        # restrict statements to the query scope
+        if self.filters or self.q.reversed or self.q.limit is not None:
+            return f"canonical_id IN ({self.canonical_ids}) AND {self.where}"
+        return self.where
+
+    def get_value(self, prop: str) -> str:
+        if PropertyTypesMap[prop].value == registry.number:
+            return NUMERIC
+        return "value"
+
+    @cached_property
+    def statements(self) -> str:
+        if self.q.sort is None:
+            return f"""SELECT {self.columns} FROM {self.name}
+            WHERE {self.scope} ORDER BY canonical_id"""
+        if len(self.q.sort.values) > 1:
+            raise ValidationError(
+                f"Multi-valued sort not supported for `{self.__class__.__name__}`"
+            )
+        prop = self.q.sort.values[0]
+        func = "min" if self.q.sort.ascending else "max"
+        order = "ASC" if self.q.sort.ascending else "DESC"
+        return f"""SELECT {self.columns} FROM {self.name}
+        INNER JOIN (
+            SELECT canonical_id, {func}({self.get_value(prop)}) AS sortable_value
+            FROM {self.name}
+            WHERE prop = {_str(prop)}
+            AND canonical_id IN ({self.all_canonical_ids})
+            GROUP BY canonical_id
+            ORDER BY sortable_value {order}, canonical_id{self.limit}
+        ) AS sorted ON {self.name}.canonical_id = sorted.canonical_id
+        WHERE {self.where}
+        ORDER BY sorted.sortable_value {order}, {self.name}.canonical_id"""
+
+    def get_statements(self, canonical_ids: str) -> str:
+        """
+        Get the statements in the query scope of the entities of a subquery
+        of canonical ids
+        """
+        return f"""SELECT {self.columns} FROM {self.name}
+        WHERE canonical_id IN ({canonical_ids}) AND {self.where}
+        ORDER BY canonical_id"""
+
+    @cached_property
+    def count(self) -> str:
+        return f"SELECT count() FROM ({self.all_canonical_ids})"
+
+    @cached_property
+    def ids_scope(self) -> str:
+        # restrict statements to all entities matching the query (no paging)
+        if self.filters or self.q.reversed:
+            return f"canonical_id IN ({self.all_canonical_ids}) AND {self.where}"
+        return self.where
+
+    def get_grouper(self, group: Field) -> tuple[str, str]:
+        # column expression and condition for grouping statements
+        column = self._get_lookup_column(group)
+        if str(group) in self.META_COLUMNS:
+            return column.name, "1"
+        if group == Fields.year:
+            return "substring(value, 1, 4)", f"prop_type = {_str(registry.date)}"
+        return "value", f"{column.name} = {_str(group)}"
+
+    def get_group_counts(
+        self,
+        group: Field,
+        limit: int | None = None,
+        extra_where: Any | None = None,
+    ) -> str:
+        grouper, where = self.get_grouper(group)
+        if extra_where is not None:
+            where = f"{where} AND {_compile(extra_where)}"
+        q = f"""SELECT {grouper} AS grouper, uniqExact(canonical_id) AS count
+        FROM {self.name} WHERE {where} AND {self.ids_scope}
+        GROUP BY grouper ORDER BY count DESC, grouper"""
+        if limit:
+            q += f" LIMIT {limit}"
+        return q
+
+    @cached_property
+    def countries_flat(self) -> str:
+        return f"""SELECT DISTINCT value FROM {self.name}
+        WHERE prop_type = {_str(registry.country)} AND {self.ids_scope}"""
+
+    @cached_property
+    def date_range(self) -> str:
+        return f"""SELECT min(value), max(value) FROM {self.name}
+        WHERE prop_type = {_str(registry.date)} AND {self.ids_scope}"""
+
+    def get_aggregator(self, agg: Aggregation) -> str:
+        if str(agg.prop) in self.META_COLUMNS:
+            column = self._get_lookup_column(agg.prop).name
+            value, where = f"{self.name}.{column}", "1"
+        else:
+            value, where = self.get_value(agg.prop), f"prop = {_str(agg.prop)}"
+        if agg.func == Aggregations.count:
+            return f"uniqExactIf({value}, {where})"
+        if agg.func in (Aggregations.sum, Aggregations.avg):
+            value = NUMERIC
+        return f"{agg.func}OrNullIf({value}, {where})"
+
+    def get_aggregators(self, aggs: list[Aggregation]) -> tuple[str, str]:
+        # aggregation columns and the statements they need
+        columns = ", ".join(self.get_aggregator(a) for a in aggs)
+        if any(str(a.prop) in self.META_COLUMNS for a in aggs):
+            return columns, "1"
+        props = ", ".join(_str(a.prop) for a in aggs)
+        return columns, f"prop IN ({props})"
+
+    def get_unique_statements(self, where: str) -> str:
+        # one version per statement id, named like the table
+        return f"""(
+            SELECT * FROM {self.name} WHERE {where} LIMIT 1 BY id
+        ) AS {self.name}"""
+
+    @cached_property
+    def aggregations(self) -> str:
+        """
+        Get one row with the values of `self.aggs` in that order
+        """
+        columns, where = self.get_aggregators(self.aggs)
+        statements = self.get_unique_statements(f"{where} AND {self.ids_scope}")
+        return f"SELECT {columns} FROM {statements}"
+
+    def get_group_aggs(self, grouper: Field) -> list[Aggregation]:
+        return [a for a in self.aggs if grouper in a.group_props]
+
+    def get_group_aggregations(self, grouper: Field, groups: list[Any]) -> str:
+        """
+        Get rows of (group, *values) of `get_group_aggs(grouper)` for the given
+        groups
+        """
+        columns, where = self.get_aggregators(self.get_group_aggs(grouper))
+        group, group_where = self.get_grouper(grouper)
+        values = ", ".join(_str(g) for g in groups)
+        statements = self.get_unique_statements(f"{where} AND {self.ids_scope}")
+        return f"""SELECT grouped.grouper, {columns} FROM {statements}
+        INNER JOIN (
+            SELECT DISTINCT canonical_id, {group} AS grouper FROM {self.name}
+            WHERE {group_where} AND {self.ids_scope} AND grouper IN ({values})
+        ) AS grouped ON {self.name}.canonical_id = grouped.canonical_id
+        GROUP BY grouped.grouper"""
+
+    @cached_property
+    def group_props(self) -> set[Field]:
+        props: set[Field] = set()
+        for agg in self.aggs:
+            props.update(agg.group_props)
+        return props
+
+
+class ClickhouseQuery(Query):
+    @property
+    def sql(self) -> ClickhouseSql:
+        return ClickhouseSql(self)
@@ -0,0 +1,310 @@
+"""
+Rebuild the fingerprint table (`table_fpx`) from the name statements, e.g.
+after changing the phonetic algorithms.
+
+The phonetic algorithms are python libraries without ClickHouse equivalents,
+so name values are streamed out per dataset in `concurrency` parallel shards
+(by `cityHash64(entity_id)`), fingerprinted with the same functions as the
+writer in a pool of `concurrency` worker processes and inserted into a
+staging table. The rebuilt dataset partition then replaces the one of
+`table_fpx` atomically (`REPLACE PARTITION`), so lookups and ingest are not
+blocked during the rebuild. Fingerprints written to the dataset in the
+meantime reach the staging table via a temporary materialized view.
+
+Fingerprint tables created before they were partitioned by dataset are
+swapped as a whole instead (`EXCHANGE TABLES`), with the fingerprints of the
+other datasets copied over. Recreate the table (`ftmcs init --recreate`
+and re-import) to rebuild datasets without copying the whole table.
+"""
+
+import logging
+from collections.abc import Iterable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cache
+from multiprocessing import get_context
+from uuid import uuid4
+
+import pandas as pd
+from followthemoney import model
+
+from ftm_columnstore.engine import ClickhouseEngine, get_engine
+from ftm_columnstore.phonetic import PhoneticAlgorithm
+from ftm_columnstore.settings import BULK_WRITE_SIZE, REINDEX_CONCURRENCY
+from ftm_columnstore.statements import (
+    COLUMNS_FPX,
+    NAME_TYPE,
+    FingerprintStatement,
+    fingerprint,
+)
+
+log = logging.getLogger(__name__)
+
+# the stop tokens of a worker process, see `get_pool`
+_stop_tokens: frozenset[str] = frozenset()
+
+
+def _in(column: str, values: Iterable[str]) -> str:
+    values = ", ".join(f"'{v}'" for v in values)
+    return f"{column} IN ({values})"
+
+
+@cache
+def get_fingerprint_schemata() -> tuple[str, ...]:
+    # see `statements.should_fingerprint_stmt`
+    return tuple(
+        sorted(
+            s.name
+            for s in model.schemata.values()
+            if s.is_a("Mention") or s.is_a("LegalEntity")
+        )
+    )
+
+
+def get_names_where(dataset: str) -> str:
+    return f"""dataset = '{dataset}' AND prop_type = '{NAME_TYPE}'
+        AND {_in("schema", get_fingerprint_schemata())} AND value != ''"""
+
+
+def get_names_query(
+    engine: ClickhouseEngine, dataset: str, shard: int, shards: int, entities: str
+) -> str:
+    return f"""SELECT DISTINCT dataset, entity_id, schema, prop, prop_type, value
+        FROM {engine.table}
+        WHERE {get_names_where(dataset)}
+        AND entity_id IN (SELECT entity_id FROM {entities})
+        AND cityHash64(entity_id) % {shards} = {shard}"""
+
+
+def get_freq_query(engine: ClickhouseEngine) -> str:
+    # see `view_fpx_freq` in `ClickhouseEngine.create_statements`
+    return f"""SELECT value, countState(value) AS freq, length(value) AS len
+        FROM {engine.table_fpx} WHERE algorithm = 'fingerprint'
+        GROUP BY value"""
+
+
+def is_partitioned(engine: ClickhouseEngine, table: str) -> bool:
+    # partitioned by dataset, see `ClickhouseEngine.create_statements`
+    with engine.connect() as conn:
+        cursor = conn.execute(
+            f"""SELECT partition_key FROM system.tables
+            WHERE database = currentDatabase() AND name = '{table}'"""
+        )
+        row = cursor.fetchone()
+    return row is not None and row[0] == "dataset"
+
+
+def get_fingerprints(
+    df: pd.DataFrame,
+    algorithms: Iterable[PhoneticAlgorithm],
+    stop_tokens: frozenset[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Get the fingerprint rows for a data frame of name values (as selected by
+    `get_names_query`) without the given stop tokens
+    """
+    algorithms = set(algorithms)
+    rows = []
+    for dataset, entity_id, schema, prop, prop_type, value in df.itertuples(
+        index=False, name=None
+    ):
+        for fp in fingerprint(value, stop_tokens):
+            if fp["value"] and fp["algorithm"] in algorithms:
+                rows.append(
+                    FingerprintStatement(
+                        **fp,
+                        dataset=dataset,
+                        entity_id=entity_id,
+                        schema=schema,
+                        prop=prop,
+                        prop_type=prop_type,
+                    )
+                )
+    return pd.DataFrame(rows, columns=COLUMNS_FPX)
+
+
+def _init_worker(stop_tokens: frozenset[str]) -> None:
+    global _stop_tokens
+    _stop_tokens = stop_tokens
+
+
+def _get_fingerprints(
+    df: pd.DataFrame, algorithms: Iterable[PhoneticAlgorithm]
+) -> pd.DataFrame:
+    return get_fingerprints(df, algorithms, _stop_tokens)
+
+
+def get_pool(engine: ClickhouseEngine, concurrency: int) -> ProcessPoolExecutor:
+    """
+    Get a pool of worker processes for the (GIL bound) fingerprinting, with
+    the current stop tokens of `engine`
+    """
+    # forked from a clean server process instead of the current one with its
+    # client or chDB threads, the server imports this module only once
+    context = get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return ProcessPoolExecutor(
+        concurrency,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(engine.get_stop_tokens(),),
+    )
+
+
+def reindex_dataset(
+    engine: ClickhouseEngine,
+    dataset: str,
+    algorithms: Iterable[PhoneticAlgorithm],
+    concurrency: int | None = REINDEX_CONCURRENCY,
+    chunksize: int | None = BULK_WRITE_SIZE,
+    pool: Executor | None = None,
+) -> int:
+    """
+    Rebuild the fingerprints of the given algorithms for one dataset and
+    return the number of fingerprints written, fingerprinting in the given
+    `pool` of worker processes (or a new one)
+    """
+    if pool is None:
+        with get_pool(engine, concurrency or REINDEX_CONCURRENCY) as pool:
+            return reindex_dataset(
+                engine, dataset, algorithms, concurrency, chunksize, pool
+            )
+    shards = concurrency or REINDEX_CONCURRENCY
+    chunksize = chunksize or BULK_WRITE_SIZE
+    algorithms = sorted(set(algorithms))
+    table = f"{engine.table_fpx}_reindex_{uuid4().hex}"
+    view = f"{table}_mv"
+    entities = f"{table}_entities"
+    partitioned = is_partitioned(engine, engine.table_fpx)
+
+    def _reindex(shard: int) -> int:
+        rows = 0
+        query = get_names_query(engine, dataset, shard, shards, entities)
+        for df in engine.query_dataframes(query, chunksize):
+            df = pool.submit(_get_fingerprints, df, algorithms).result()
+            rows += engine.insert(df, table)
+        return rows
+
+    log.info(f"Rebuilding `{engine.table_fpx}` for dataset `{dataset}` ...")
+    # fingerprints written during the rebuild (all datasets of an
+    # unpartitioned table, as it is swapped as a whole)
+    written = "1" if not partitioned else f"dataset = '{dataset}'"
+    with engine.connect() as conn:
+        conn.execute(f"CREATE TABLE {table} AS {engine.table_fpx}")
+        conn.execute(
+            f"""CREATE MATERIALIZED VIEW {view} TO {table}
+            AS SELECT * FROM {engine.table_fpx} WHERE {written}"""
+        )
+    try:
+        with engine.connect() as conn:
+            conn.execute(
+                f"""CREATE TABLE {entities} ENGINE = Memory AS
+                SELECT DISTINCT entity_id FROM {engine.table}
+                WHERE {get_names_where(dataset)}"""
+            )
+            # keep the fingerprints of the other algorithms
+            conn.execute(
+                f"""INSERT INTO {table} SELECT * FROM {engine.table_fpx}
+                WHERE dataset = '{dataset}'
+                AND NOT {_in("algorithm", algorithms)}
+                AND entity_id IN (SELECT entity_id FROM {entities})"""
+            )
+        with ThreadPoolExecutor(shards) as threads:
+            rows = sum(threads.map(_reindex, range(shards)))
+        with engine.connect() as conn:
+            if partitioned:
+                conn.execute(
+                    f"ALTER TABLE {engine.table_fpx} "
+                    f"REPLACE PARTITION '{dataset}' FROM {table}"
+                )
+            else:
+                log.warning(
+                    f"`{engine.table_fpx}` is not partitioned by dataset, "
+                    "swapping the whole table."
+                )
+                conn.execute(
+                    f"""INSERT INTO {table} SELECT * FROM {engine.table_fpx}
+                    WHERE dataset != '{dataset}'"""
+                )
+                conn.execute(f"EXCHANGE TABLES {engine.table_fpx} AND {table}")
+    finally:
+        with engine.connect() as conn:
+            conn.execute(f"DROP VIEW IF EXISTS {view}")
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"DROP TABLE IF EXISTS {entities}")
+    log.info(f"Rebuilt {rows} fingerprints for dataset `{dataset}`.")
+    return rows
+
+
+def reindex_fpx(
+    engine: ClickhouseEngine | None = None,
+    datasets: Iterable[str] | None = None,
+    algorithms: Iterable[PhoneticAlgorithm] | None = None,
+    concurrency: int | None = REINDEX_CONCURRENCY,
+    chunksize: int | None = BULK_WRITE_SIZE,
+) -> dict[str, int]:
+    """
+    Rebuild the fingerprints of the given algorithms (default all) for the
+    given datasets (default all) one dataset after another. The
+    `view_fpx_freq` token frequencies are recomputed afterwards, keeping the
+    frequencies of the current stop tokens (which are not written anymore).
+    """
+    engine = engine or get_engine()
+    concurrency = concurrency or REINDEX_CONCURRENCY
+    algorithms = list(algorithms or PhoneticAlgorithm)
+    if not datasets:
+        with engine.connect() as conn:
+            cursor = conn.execute(
+                f"SELECT DISTINCT dataset FROM {engine.table} ORDER BY dataset"
+            )
+            datasets = [row[0] for row in cursor.fetchall()]
+    with get_pool(engine, concurrency) as pool:
+        res = {
+            dataset: reindex_dataset(
+                engine, dataset, algorithms, concurrency, chunksize, pool
+            )
+            for dataset in datasets
+        }
+    if PhoneticAlgorithm.fingerprint in algorithms:
+        reindex_freq(engine)
+    return res
+
+
+def reindex_freq(engine: ClickhouseEngine) -> None:
+    """
+    Recompute the `view_fpx_freq` token frequencies into a staging table that
+    replaces the view data at once, so that the stop tokens stay available.
+    The frequencies of the current stop tokens are kept instead of counted
+    again, fingerprints written meanwhile reach the staging table via a
+    temporary materialized view.
+    """
+    log.info(f"Populating `{engine.view_fpx_freq}` ...")
+    table = f"{engine.view_fpx_freq}_reindex_{uuid4().hex}"
+    view = f"{table}_mv"
+    stop_tokens = "0"
+    if engine.fpx_max_freq:
+        stop_tokens = f"""value IN (
+            SELECT value FROM {engine.view_fpx_freq} GROUP BY value
+            HAVING countMerge(freq) > {engine.fpx_max_freq}
+        )"""
+    with engine.connect() as conn:
+        conn.execute(f"CREATE TABLE {table} AS {engine.view_fpx_freq}")
+        try:
+            conn.execute(
+                f"""CREATE MATERIALIZED VIEW {view} TO {table}
+                AS {get_freq_query(engine)}"""
+            )
+            conn.execute(
+                f"""INSERT INTO {table} SELECT value, freq, len
+                FROM {engine.view_fpx_freq} WHERE {stop_tokens}"""
+            )
+            conn.execute(
+                f"""INSERT INTO {table} SELECT * FROM ({get_freq_query(engine)})
+                WHERE NOT {stop_tokens}"""
+            )
+            conn.execute(
+                f"ALTER TABLE {engine.view_fpx_freq} "
+                f"REPLACE PARTITION tuple() FROM {table}"
+            )
+        finally:
+            conn.execute(f"DROP VIEW IF EXISTS {view}")
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
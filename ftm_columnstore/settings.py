@@ -1,15 +1,105 @@
 import os
+from typing import Any
+
+from banal import as_bool
 
 VERSION = "0.3.2"
 
 
-def get_env(name, default):
+def get_env(name: str, default: Any) -> str:
     value = os.environ.get(name)
     if value is not None:
         return str(value)
     return str(default)
 
 
+def get_profile(name: str, default: dict[str, Any]) -> dict[str, str]:
+    """
+    Get client settings of an operation profile, overridden by the env var
+    `<NAME>_SETTINGS` as comma separated `key=value` pairs
+    """
+    profile = {k: str(v) for k, v in default.items()}
+    for item in get_env(f"{name.upper()}_SETTINGS", "").split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            profile[key.strip()] = value.strip()
+    return profile
+
+
 DATABASE_URI = get_env("DATABASE_URI", "clickhouse://localhost/default")
 LOG_LEVEL = get_env("LOG_LEVEL", "INFO")
 BULK_WRITE_SIZE = int(get_env("BULK_WRITE_SIZE", 100_000))
+# idle client connections kept per engine
+CONNECTION_POOL_SIZE = int(get_env("CONNECTION_POOL_SIZE", 8))
+# adaptive write batches: statements per batch are tuned within these bounds
+# towards the target insert latency (seconds) and never exceed the memory
+# ceiling (bytes)
+BULK_WRITE_MIN_SIZE = int(get_env("BULK_WRITE_MIN_SIZE", 1_000))
+BULK_WRITE_MAX_SIZE = int(get_env("BULK_WRITE_MAX_SIZE", 1_000_000))
+BULK_WRITE_MEMORY = int(get_env("BULK_WRITE_MEMORY", 256 * 1024 * 1024))
+BULK_WRITE_LATENCY = float(get_env("BULK_WRITE_LATENCY", 5))
+# back off and retry inserts on "too many parts" or memory limit errors
+WRITE_RETRIES = int(get_env("WRITE_RETRIES", 5))
+WRITE_BACKOFF = float(get_env("WRITE_BACKOFF", 1))
+# incremental optimize scheduler
+OPTIMIZE_CONCURRENCY = int(get_env("OPTIMIZE_CONCURRENCY", 2))
+OPTIMIZE_TIMEOUT = int(get_env("OPTIMIZE_TIMEOUT", 3600))  # seconds
+OPTIMIZE_MIN_PARTS = int(get_env("OPTIMIZE_MIN_PARTS", 2))
+# deduplicate statements on read instead of relying on `OPTIMIZE ... FINAL`
+DEDUPLICATE_READS = as_bool(get_env("DEDUPLICATE_READS", False))
+# graph expansion: max entities per expansion and neighbours per entity
+EXPAND_LIMIT = int(get_env("EXPAND_LIMIT", 10_000))
+EXPAND_FANOUT = int(get_env("EXPAND_FANOUT", 1_000))
+# keep one pre-aggregated snapshot per entity for fast entity reads
+ENTITY_SNAPSHOTS = as_bool(get_env("ENTITY_SNAPSHOTS", False))
+# check every this many seconds whether derived tables (edges, snapshots) are
+# populated, until then lookups read the statement table
+BACKFILL_REFRESH = int(get_env("BACKFILL_REFRESH", 60))
+# log queries slower than this (seconds) for `ftmcs explain`
+SLOW_QUERY_THRESHOLD = float(get_env("SLOW_QUERY_THRESHOLD", 1))
+SLOW_QUERY_LOG_SIZE = int(get_env("SLOW_QUERY_LOG_SIZE", 100))
+# parallel shards per dataset for `ftmcs reindex-fpx`
+REINDEX_CONCURRENCY = int(get_env("REINDEX_CONCURRENCY", 4))
+# don't write fingerprint tokens (and their phonetics) that occur more than
+# this often according to `view_fpx_freq` (0: no limit), refreshed every
+# `FPX_STOP_TOKENS_REFRESH` seconds
+FPX_MAX_FREQ = int(get_env("FPX_MAX_FREQ", 10_000))
+FPX_STOP_TOKENS_REFRESH = int(get_env("FPX_STOP_TOKENS_REFRESH", 600))
+# `ftmcs write-many`: datasets written in parallel and their total memory
+# budget (bytes) for write batches
+WRITE_MANY_CONCURRENCY = int(get_env("WRITE_MANY_CONCURRENCY", 4))
+WRITE_MANY_MEMORY = int(get_env("WRITE_MANY_MEMORY", 1024 * 1024 * 1024))
+# native protocol compression for bulk transfers: lz4, lz4hc or zstd (requires
+# the `zstd` extra), empty to disable
+COMPRESSION = get_env("COMPRESSION", "lz4")
+# client settings per operation: `compression` and ClickHouse query settings
+PROFILES = {
+    # large batches via the writer, async inserts would only add latency
+    "ingest": get_profile(
+        "ingest",
+        {
+            "compression": COMPRESSION,
+            "async_insert": 0,
+            "max_insert_block_size": BULK_WRITE_MAX_SIZE,
+        },
+    ),
+    # primary key reads of single entities
+    "lookup": get_profile(
+        "lookup",
+        {"max_threads": 2, "max_block_size": 8192, "optimize_read_in_order": 1},
+    ),
+    # full scans in primary key order (`iterate`, `entities`, streaming reads)
+    "export": get_profile(
+        "export",
+        {
+            "compression": COMPRESSION,
+            "max_block_size": 65536,
+            "optimize_read_in_order": 1,
+        },
+    ),
+    # bulk judgement exports and imports
+    "xref": get_profile(
+        "xref",
+        {"compression": COMPRESSION, "optimize_read_in_order": 1},
+    ),
+}
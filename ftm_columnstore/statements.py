@@ -14,6 +14,11 @@ FS = TypeVar("FS", bound="FingerprintStatement")
 
 NAME_TYPE = str(registry.name)
 
+# approximate per statement and per fingerprint row memory overhead (python
+# objects, data frame row) on top of their string values
+STATEMENT_OVERHEAD = 512
+FINGERPRINT_OVERHEAD = 256
+
 
 class Fingerprint(TypedDict):
     algorithm: str
@@ -41,10 +46,12 @@ def get_schema(schema: str | Schema) -> Schema:
 
 
 @lru_cache(1_000_000)
-def fingerprint(value: str) -> list[Fingerprint]:
+def fingerprint(
+    value: str, stop_tokens: frozenset[str] | None = None
+) -> list[Fingerprint]:
     fingerprints: list[Fingerprint] = []
     for algorithm in PhoneticAlgorithm:
-        for v in get_phonetics(value, algorithm.value):
+        for v in get_phonetics(value, algorithm.value, stop_tokens):
             fingerprints.append({"algorithm": algorithm.value, "value": v})
     return fingerprints
 
@@ -58,16 +65,75 @@ def should_fingerprint_stmt(stmt: Statement) -> bool:
     return False
 
 
-def fingerprints_from_entity(entity: CE) -> Generator[FS, None, None]:
-    yield from fingerprints_from_statements(entity.statements)
+def get_statement_size(
+    stmt: Statement, stop_tokens: frozenset[str] | None = None
+) -> int:
+    """Estimate the memory size in bytes of a statement and its fingerprint
+    rows within a write batch"""
+    size = STATEMENT_OVERHEAD
+    for value in (
+        stmt.id,
+        stmt.entity_id,
+        stmt.canonical_id,
+        stmt.prop,
+        stmt.schema,
+        stmt.value,
+        stmt.original_value,
+        stmt.dataset,
+        stmt.lang,
+    ):
+        if value is not None:
+            size += len(value)
+    if should_fingerprint_stmt(stmt):
+        row = FINGERPRINT_OVERHEAD + sum(
+            len(v or "")
+            for v in (
+                stmt.dataset,
+                stmt.entity_id,
+                stmt.schema,
+                stmt.prop,
+                stmt.prop_type,
+            )
+        )
+        for fp in fingerprint(stmt.value, stop_tokens):
+            if fp["value"]:
+                size += row + len(fp["value"])
+    return size
+
+
+def deduplicate_statements(
+    statements: Iterable[Statement],
+) -> Generator[Statement, None, None]:
+    """Drop duplicate versions (same `id`) from a stream of statements ordered
+    by `canonical_id` and keep the one with the latest `last_seen`, the same
+    as the `ReplacingMergeTree` would do after merging its parts"""
+    current_id = None
+    seen: dict[str | None, Statement] = {}
+    for stmt in statements:
+        if stmt.canonical_id != current_id:
+            yield from seen.values()
+            current_id = stmt.canonical_id
+            seen = {}
+        existing = seen.get(stmt.id)
+        if existing is None or existing.last_seen is None:
+            seen[stmt.id] = stmt
+        elif stmt.last_seen is not None and stmt.last_seen > existing.last_seen:
+            seen[stmt.id] = stmt
+    yield from seen.values()
+
+
+def fingerprints_from_entity(
+    entity: CE, stop_tokens: frozenset[str] | None = None
+) -> Generator[FS, None, None]:
+    yield from fingerprints_from_statements(entity.statements, stop_tokens)
 
 
 def fingerprints_from_statements(
-    statements: Iterable[Statement],
+    statements: Iterable[Statement], stop_tokens: frozenset[str] | None = None
 ) -> Generator[FS, None, None]:
     for stmt in statements:
         if should_fingerprint_stmt(stmt):
-            for fp in fingerprint(stmt.value):
+            for fp in fingerprint(stmt.value, stop_tokens):
                 if fp["value"]:
                     yield {
                         **{
@@ -1,5 +1,9 @@
-from collections.abc import Generator
+import logging
+import time
+from collections.abc import Generator, Iterable
+from datetime import datetime
 from functools import cache
+from typing import Any, cast
 
 import pandas as pd
 from ftmq.model.dataset import C, Dataset
@@ -7,18 +11,42 @@ from ftmq.store import SQLStore
 from nomenklatura import store as nk
 from nomenklatura.dataset import DS
 from nomenklatura.db import get_metadata
-from nomenklatura.entity import CE
+from nomenklatura.entity import CE, CompositeEntity
 from nomenklatura.resolver import Resolver
 from nomenklatura.statement import Statement, make_statement_table
+from nomenklatura.statement.statement import StatementDict
 from sqlalchemy import MetaData, select
 from sqlalchemy.sql.selectable import Select
 
-from ftm_columnstore.engine import get_engine
-from ftm_columnstore.settings import BULK_WRITE_SIZE
-from ftm_columnstore.statements import fingerprints_from_statements
+from ftm_columnstore.changes import (
+    ChangeType,
+    get_changed_statements_query,
+    get_changes_query,
+    get_first_seen_query,
+    get_unstamped_query,
+)
+from ftm_columnstore.engine import ClickhouseEngine, get_engine
+from ftm_columnstore.settings import (
+    BULK_WRITE_LATENCY,
+    BULK_WRITE_MAX_SIZE,
+    BULK_WRITE_MEMORY,
+    BULK_WRITE_MIN_SIZE,
+    BULK_WRITE_SIZE,
+    DEDUPLICATE_READS,
+    EXPAND_FANOUT,
+    EXPAND_LIMIT,
+)
+from ftm_columnstore.statements import (
+    deduplicate_statements,
+    fingerprints_from_statements,
+    get_statement_size,
+)
+from ftm_columnstore.view import ClickhouseView
 
+log = logging.getLogger(__name__)
 
-class BaseClickhouseStore(nk.SQLStore):
+
+class BaseClickhouseStore(nk.SQLStore[DS, CE]):
     def __init__(
         self,
         dataset: DS,
@@ -28,37 +56,166 @@ class BaseClickhouseStore(nk.SQLStore):
         super().__init__(dataset, linker)
         self.metadata = MetaData()
         self.table = make_statement_table(self.metadata)
-        self.engine = get_engine(uri)
+        self.engine: ClickhouseEngine = get_engine(uri)
         self.columns = [c.name for c in self.table.columns]
+        self.deduplicate = DEDUPLICATE_READS
+
+    def writer(self, max_batch_bytes: int | None = None) -> "ClickhouseWriter[DS, CE]":
+        return ClickhouseWriter(self, max_batch_bytes)
 
-    def writer(self) -> nk.Writer[DS, CE]:
-        return ClickhouseWriter(self)
+    def view(self, scope: DS, external: bool = False) -> ClickhouseView:
+        return ClickhouseView(self, scope, external=external)
 
-    def view(self, scope: DS, external: bool = False) -> nk.View[DS, CE]:
-        return nk.sql.SQLView(self, scope, external=external)
+    def _execute(
+        self, q: Select | str, stream: bool = True, profile: str | None = None
+    ) -> Generator[Any, None, None]:
+        with self.engine.connect(profile=profile) as conn:
+            if stream:
+                conn = conn.execution_options(stream_results=True)
+            cursor = conn.execute(q)
+            while rows := cursor.fetchmany(10_000):
+                yield from rows
 
     def _iterate_stmts(
-        self, q: Select, *args, **kwargs
+        self, q: Select | str, stream: bool = True, *args: Any, **kwargs: Any
     ) -> Generator[Statement, None, None]:
-        for row in self._execute(q):
-            data = dict(zip(self.columns, row))
-            yield Statement.from_dict(data)
+        # streamed statements are exports (`iterate`, `entities`), the others
+        # entity lookups
+        profile = "export" if stream else "lookup"
+        statements = (
+            Statement.from_dict(cast(StatementDict, dict(zip(self.columns, row))))
+            for row in self._execute(q, profile=profile)
+        )
+        if self.deduplicate:
+            # don't rely on (maybe not yet happened) `OPTIMIZE ... FINAL`
+            statements = deduplicate_statements(statements)
+        yield from statements
+
+    def expand(
+        self,
+        ids: Iterable[str],
+        depth: int = 1,
+        schemata: Iterable[str] | None = None,
+        limit: int | None = EXPAND_LIMIT,
+        fanout: int | None = EXPAND_FANOUT,
+    ) -> Generator[CE, None, None]:
+        """
+        Get the entities within `depth` hops of the given entity ids, see
+        `ClickhouseView.expand`
+        """
+        view = self.view(self.dataset)
+        yield from view.expand(ids, depth, schemata, limit, fanout)
+
+    def changes(
+        self, dataset: Dataset | str, since: datetime | str
+    ) -> Generator[tuple[ChangeType, CE], None, None]:
+        """
+        Get the added, changed and removed entities of `dataset` between the
+        version at `since` and the latest version. Removed entities are
+        returned in their version at `since`, all others in the latest one.
+        """
+        if isinstance(dataset, Dataset):
+            dataset = dataset.name
+        q = get_unstamped_query(self.engine.table, dataset)
+        for (unstamped,) in self._execute(q, stream=False):
+            if unstamped:
+                raise ValueError(
+                    f"Dataset `{dataset}` has {unstamped} statements without "
+                    "`last_seen`, can not compute changes between versions."
+                )
+        q = get_changes_query(self.engine.table, dataset, since)
+        changes = {c: ChangeType(t) for c, t in self._execute(q, stream=False)}
+        if changes:
+            q = get_changed_statements_query(
+                self.engine.table, self.columns, dataset, since
+            )
+            for proxy in self._iterate(q):
+                change = changes.get(proxy.id)
+                if change is not None:
+                    yield change, proxy
 
 
-class ClickhouseStore(SQLStore, BaseClickhouseStore):
-    pass
+class ClickhouseStore(SQLStore, BaseClickhouseStore[DS, CE]):
+    def query(self, scope: DS | None = None, external: bool = False) -> ClickhouseView:
+        scope = scope or self.dataset
+        return ClickhouseView(self, scope, external=external)
 
 
 class ClickhouseWriter(nk.sql.SQLWriter[DS, CE]):
     BATCH_STATEMENTS = BULK_WRITE_SIZE
+    MIN_BATCH_STATEMENTS = BULK_WRITE_MIN_SIZE
+    MAX_BATCH_STATEMENTS = BULK_WRITE_MAX_SIZE
+    MAX_BATCH_BYTES = BULK_WRITE_MEMORY
+    TARGET_LATENCY = BULK_WRITE_LATENCY
+
+    store: BaseClickhouseStore[DS, CE]
+
+    def __init__(
+        self, store: BaseClickhouseStore[DS, CE], max_batch_bytes: int | None = None
+    ):
+        super().__init__(store)
+        self.batch_size = self.BATCH_STATEMENTS
+        self.batch_bytes = 0
+        if max_batch_bytes:
+            self.MAX_BATCH_BYTES = max_batch_bytes
+        self.written = 0
+        # the version of statements without timestamps, see `changes`
+        self.version = datetime.now().isoformat(timespec="milliseconds")
+
+    def add_statement(self, stmt: Statement) -> None:
+        if stmt.entity_id is None:
+            return
+        stmt.canonical_id = self.store.linker.get_canonical(stmt.entity_id)
+        if stmt.last_seen is None:
+            stmt.last_seen = self.version
+        if stmt not in self.batch:
+            stop_tokens = self.store.engine.get_stop_tokens()
+            self.batch_bytes += get_statement_size(stmt, stop_tokens)
+            self.batch.add(stmt)
+        if len(self.batch) >= self.batch_size:
+            self._upsert_batch()
+        elif self.batch_bytes >= self.MAX_BATCH_BYTES:
+            self._upsert_batch()
+
+    def _tune(self, size: int, elapsed: float) -> None:
+        # move the batch size towards the target insert latency, the memory
+        # ceiling is enforced by `add_statement`
+        optimal = size * self.TARGET_LATENCY / max(elapsed, 0.001)
+        batch_size = int((self.batch_size + optimal) / 2)
+        self.batch_size = max(
+            self.MIN_BATCH_STATEMENTS, min(self.MAX_BATCH_STATEMENTS, batch_size)
+        )
+        log.debug(
+            f"Inserted {size} statements ({self.batch_bytes} bytes) in "
+            f"{elapsed:.2f}s, next batch size: {self.batch_size}"
+        )
+
+    def _stamp_first_seen(self) -> None:
+        # carry over `first_seen` of re-imported statements, as the merged
+        # table only keeps their latest row
+        statements = [s for s in self.batch if s.first_seen is None]
+        if statements:
+            q = get_first_seen_query(self.store.engine.table, statements)
+            first_seen = dict(self.store._execute(q, stream=False))
+            for stmt in statements:
+                ts = first_seen.get(stmt.id)
+                stmt.first_seen = ts.isoformat() if ts else stmt.last_seen
 
     def _upsert_batch(self) -> None:
         if self.batch:
+            engine = self.store.engine
+            self._stamp_first_seen()
             df = pd.DataFrame([s.to_dict() for s in self.batch])
-            self.store.engine.insert(df, self.store.engine.table)
-            df = pd.DataFrame(fingerprints_from_statements(self.batch))
-            self.store.engine.insert(df, self.store.engine.table_fpx)
+            stop_tokens = engine.get_stop_tokens()
+            df_fpx = pd.DataFrame(fingerprints_from_statements(self.batch, stop_tokens))
+            # tune by the insert latency only, not by the python side work
+            start = time.time()
+            engine.insert(df, engine.table)
+            engine.insert(df_fpx, engine.table_fpx)
+            self._tune(len(self.batch), time.time() - start)
+            self.written += len(self.batch)
         self.batch = set()
+        self.batch_bytes = 0
 
     def pop(self, entity_id: str) -> list[Statement]:
         self.flush()
@@ -76,8 +233,8 @@ def get_store(
     catalog: C | None = None,
     dataset: Dataset | str | None = None,
     uri: str | None = None,
-    linker: Resolver | str | None = None,
-) -> ClickhouseStore:
+    linker: Resolver[CompositeEntity] | str | None = None,
+) -> ClickhouseStore[Dataset, CompositeEntity]:
     get_metadata.cache_clear()
     if isinstance(dataset, str):
         dataset = Dataset(name=dataset)
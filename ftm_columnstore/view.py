@@ -0,0 +1,245 @@
+import logging
+from collections import defaultdict
+from collections.abc import Generator, Iterable
+from uuid import uuid4
+
+from anystore.util import clean_dict
+from followthemoney.property import Property
+from followthemoney.types import registry
+from ftmq.aggregations import AggregatorResult
+from ftmq.enums import Fields
+from ftmq.query import Q, Query
+from ftmq.store.sql import MAX_SQL_AGG_GROUPS, SQLQueryView, clean_agg_value
+from ftmq.types import CE, CEGenerator
+from nomenklatura import store as nk
+from nomenklatura.resolver import Identifier
+
+from ftm_columnstore.engine import SNAPSHOT_COLUMNS
+from ftm_columnstore.query import ClickhouseQuery
+from ftm_columnstore.settings import EXPAND_FANOUT, EXPAND_LIMIT
+
+log = logging.getLogger(__name__)
+
+# entity ids per query when streaming the expanded subgraph, to stay below
+# the server `max_query_size`
+EXPAND_CHUNKSIZE = 1_000
+
+
+class ClickhouseView(SQLQueryView):
+    """
+    Store view that answers inverted and adjacent lookups from the edge table
+    instead of scanning all entity-typed statements, and compiles `ftmq`
+    queries, stats and aggregations into native ClickHouse SQL
+    """
+
+    def _in(self, column: str, values: Iterable[str]) -> str:
+        values = ", ".join(f"'{v}'" for v in values)
+        return f"{column} IN ({values})"
+
+    def _iterate_ids(self, ids: str) -> CEGenerator:
+        # entities for a subquery of canonical ids within the view scope
+        query = self.ensure_scoped_query(Query())
+        yield from self.store._iterate(query.sql.get_statements(ids))
+
+    def ensure_scoped_query(self, query: Q) -> ClickhouseQuery:
+        # compile all queries of the `ftmq` view methods via `ClickhouseSql`
+        if not isinstance(query, ClickhouseQuery):
+            query = ClickhouseQuery(**query.__dict__)
+        scoped: ClickhouseQuery = super().ensure_scoped_query(query)
+        return scoped
+
+    def entities(self, query: Q | None = None) -> CEGenerator:
+        if query:
+            yield from super().entities(query)
+        else:
+            yield from nk.sql.SQLView.entities(self)
+
+    def aggregations(self, query: Q) -> AggregatorResult | None:
+        if not query.aggregations:
+            return None
+        query = self.ensure_scoped_query(query)
+        key = f"agg-{hash(query)}"
+        if key in self._cache:
+            return self._cache[key]
+
+        # all values in one row (per group) instead of the `ftmq` rows of
+        # (prop, func, value), as the value types differ
+        sql = query.sql
+        res: AggregatorResult = defaultdict(dict)
+        for row in self.store._execute(sql.aggregations, stream=False):
+            for agg, value in zip(sql.aggs, row):
+                res[agg.func][agg.prop] = clean_agg_value(value)
+
+        if sql.group_props:
+            res["groups"] = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
+        for prop in sql.group_props:
+            if prop == Fields.year:
+                start, end = self.stats(query).coverage.years
+                if start or end:
+                    groups = list(range(start or end, (end or start) + 1))
+                else:
+                    groups = []
+            else:
+                q = sql.get_group_counts(prop, limit=MAX_SQL_AGG_GROUPS)
+                groups = [r[0] for r in self.store._execute(q, stream=False)]
+            if not groups:
+                continue
+            aggs = sql.get_group_aggs(prop)
+            q = sql.get_group_aggregations(prop, groups)
+            for group, *values in self.store._execute(q, stream=False):
+                for agg, value in zip(aggs, values):
+                    value = clean_agg_value(value)
+                    res["groups"][prop][agg.func][agg.prop][group] = value
+        res = clean_dict(res)
+        self._cache[key] = res
+        return res
+
+    def get_entity(self, id: str) -> CE | None:
+        engine = self.store.engine
+        # until `backfill` the snapshots of older entities are incomplete
+        if engine.snapshots and engine.table_entities in engine.get_backfilled():
+            entity = self.get_snapshot(id)
+            if entity is not None:
+                return entity
+        return super().get_entity(id)
+
+    def get_snapshot(self, id: str) -> CE | None:
+        """
+        Get an entity from the pre-aggregated snapshot table (one primary key
+        read), its statements are unpacked into regular statement rows
+        """
+        engine = self.store.engine
+        columns = ", ".join(
+            f"tupleElement(statement, '{c}') AS {c}" if c in SNAPSHOT_COLUMNS else c
+            for c in self.store.columns
+        )
+        q = f"""SELECT {columns} FROM (
+            SELECT canonical_id, dataset,
+                groupUniqArrayArray(statements) AS statements,
+                max(last_seen) AS last_seen
+            FROM {engine.table_entities}
+            WHERE canonical_id = '{id}'
+            AND {self._in("dataset", self.dataset_names)}
+            GROUP BY canonical_id, dataset
+        ) ARRAY JOIN statements AS statement
+        ORDER BY entity_id"""
+        for entity in self.store._iterate(q, stream=False):
+            return entity
+        return None
+
+    def get_inverted(self, id: str) -> Generator[tuple[Property, CE], None, None]:
+        ids = [i.id for i in self.store.linker.connected(Identifier.get(id))]
+        q = f"""SELECT canonical_id FROM {self.store.engine.edges}
+        WHERE {self._in("value", ids)}
+        AND {self._in("dataset", self.dataset_names)}"""
+        for entity in self._iterate_ids(q):
+            for prop, value in entity.itervalues():
+                if value == id and prop.reverse is not None:
+                    yield prop.reverse, entity
+
+    def get_adjacent(
+        self, entity: CE, inverted: bool = True
+    ) -> Generator[tuple[Property, CE], None, None]:
+        props: dict[str, set[Property]] = {}
+        for prop, value in entity.itervalues():
+            if prop.type == registry.entity:
+                props.setdefault(value, set()).add(prop)
+        if props and entity.id is not None:
+            ids = f"""SELECT value FROM {self.store.engine.edges}
+            WHERE canonical_id = '{entity.id}'
+            AND {self._in("dataset", self.dataset_names)}"""
+            for child in self._iterate_ids(ids):
+                for prop in props.get(child.id, []):
+                    yield prop, child
+
+        if inverted and entity.id is not None:
+            yield from self.get_inverted(entity.id)
+
+    def expand(
+        self,
+        ids: Iterable[str],
+        depth: int = 1,
+        schemata: Iterable[str] | None = None,
+        limit: int | None = EXPAND_LIMIT,
+        fanout: int | None = EXPAND_FANOUT,
+    ) -> CEGenerator:
+        """
+        Get the subgraph within `depth` hops of the given entity ids (in both
+        directions) via a breadth-first expansion with one query per hop on
+        the edge table. The frontier is kept and deduplicated within
+        ClickHouse.
+
+        Args:
+            ids: Entity ids to start from
+            depth: Number of hops
+            schemata: Only traverse and return entities of these schemata
+                (the start entities are always included)
+            limit: Maximum number of entities in the subgraph (`None` for no
+                limit)
+            fanout: Maximum number of neighbours to follow per entity, to not
+                explode on hub nodes (`None` for no limit)
+        """
+        engine = self.store.engine
+        edges = engine.edges
+        table = f"{engine.table_edges}_expand_{uuid4().hex}"
+        datasets = self._in("dataset", self.dataset_names)
+        seeds = sorted({self.store.linker.get_canonical(i) for i in ids})[:limit]
+        if not seeds:
+            return
+        values = ", ".join(f"('{i}', 0)" for i in seeds)
+        limit_by = f"LIMIT {fanout} BY source" if fanout is not None else ""
+        with engine.connect() as conn:
+            conn.execute(
+                f"CREATE TABLE {table} (id String, depth UInt8) ENGINE = Memory"
+            )
+            try:
+                conn.execute(f"INSERT INTO {table} VALUES {values}")
+                for hop in range(1, depth + 1):
+                    frontier = f"SELECT id FROM {table} WHERE depth = {hop - 1}"
+                    neighbours = f"""
+                    SELECT id FROM (
+                        SELECT value AS id, canonical_id AS source FROM {edges}
+                        WHERE canonical_id IN ({frontier}) AND {datasets}
+                        UNION ALL
+                        SELECT canonical_id AS id, value AS source FROM {edges}
+                        WHERE value IN ({frontier}) AND {datasets}
+                    )
+                    WHERE id NOT IN (SELECT id FROM {table})
+                    {limit_by}
+                    """
+                    where = ""
+                    if schemata:
+                        where = f"""WHERE id IN (
+                            SELECT canonical_id FROM {engine.table}
+                            WHERE canonical_id IN ({neighbours})
+                            AND {self._in("schema", schemata)} AND {datasets}
+                        )"""
+                    limit_remaining = ""
+                    if limit is not None:
+                        cursor = conn.execute(f"SELECT count() FROM {table}")
+                        remaining = limit - cursor.fetchone()[0]
+                        if remaining < 1:
+                            break
+                        limit_remaining = f"LIMIT {remaining}"
+                    conn.execute(
+                        f"""INSERT INTO {table}
+                        SELECT id, {hop} FROM ({neighbours})
+                        {where}
+                        GROUP BY id
+                        {limit_remaining}"""
+                    )
+                    cursor = conn.execute(
+                        f"SELECT count() FROM {table} WHERE depth = {hop}"
+                    )
+                    expanded = cursor.fetchone()[0]
+                    log.debug(f"Expanded hop {hop}: {expanded} entities")
+                    if not expanded:
+                        break
+                cursor = conn.execute(f"SELECT id FROM {table} ORDER BY id")
+                subgraph = [row[0] for row in cursor.fetchall()]
+            finally:
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+        # don't keep the connection and the frontier table while streaming
+        for start in range(0, len(subgraph), EXPAND_CHUNKSIZE):
+            chunk = subgraph[start : start + EXPAND_CHUNKSIZE]
+            yield from self._iterate_ids(", ".join(f"'{i}'" for i in chunk))
@@ -0,0 +1,296 @@
+"""
+Bulk exchange of xref judgements between the `table_xref` and a nomenklatura
+`Resolver`
+"""
+
+import logging
+from collections.abc import Generator, Iterable
+from datetime import datetime
+from hashlib import sha1
+from typing import Any
+from uuid import uuid4
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+from nomenklatura.entity import CompositeEntity
+from nomenklatura.judgement import Judgement
+from nomenklatura.resolver import Edge, Identifier, Resolver
+
+from ftm_columnstore.engine import ClickhouseEngine, get_engine
+from ftm_columnstore.settings import BULK_WRITE_SIZE
+
+log = logging.getLogger(__name__)
+
+COLUMNS_JUDGEMENTS = ("left_id", "right_id", "judgement", "score", "ts", "user")
+COLUMNS_EDGES = ("target", "source", "judgement", "score", "ts", "user")
+
+
+def _in(column: str, values: Iterable[str]) -> str:
+    values = ", ".join(f"'{v}'" for v in values)
+    return f"{column} IN ({values})"
+
+
+def iter_judgements(
+    engine: ClickhouseEngine | None = None,
+    datasets: Iterable[str] | None = None,
+    judgements: Iterable[Judgement] | None = None,
+    chunksize: int | None = BULK_WRITE_SIZE,
+) -> Generator[pd.DataFrame, None, None]:
+    """
+    Stream xref judgements as data frames of `chunksize` rows. The query is
+    filtered and sorted by the `_reverse` projection of the xref table, so
+    ClickHouse reads the judgements in large sequential blocks.
+    """
+    engine = engine or get_engine()
+    filters = []
+    if datasets:
+        # include edges to canonical ids which don't belong to a dataset
+        datasets = [*datasets, ""]
+        filters.append(_in("right_dataset", datasets))
+        filters.append(_in("left_dataset", datasets))
+    if judgements:
+        filters.append(_in("judgement", [j.value for j in judgements]))
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    query = f"""SELECT left_id, right_id, judgement, toFloat64(score) AS score,
+        ts, user FROM {engine.table_xref} {where}
+        ORDER BY right_dataset, right_schema, right_id,
+        left_dataset, left_schema, left_id"""
+    yield from engine.query_dataframes(query, chunksize, "xref")
+
+
+def get_judgements(
+    engine: ClickhouseEngine | None = None,
+    datasets: Iterable[str] | None = None,
+    judgements: Iterable[Judgement] | None = None,
+    chunksize: int | None = BULK_WRITE_SIZE,
+) -> pd.DataFrame:
+    """
+    Get the latest judgement for each (unordered) pair of entities
+    """
+    frames = list(iter_judgements(engine, datasets, judgements, chunksize))
+    if not frames:
+        return pd.DataFrame(columns=COLUMNS_JUDGEMENTS)
+    df = pd.concat(frames, ignore_index=True)
+    if df.empty:
+        return pd.DataFrame(columns=COLUMNS_JUDGEMENTS)
+    left, right = df["left_id"].values, df["right_id"].values
+    df["_source"] = np.where(left < right, left, right)
+    df["_target"] = np.where(left < right, right, left)
+    df = df.sort_values("ts", kind="stable")
+    df = df.drop_duplicates(("_source", "_target"), keep="last")
+    df = df[df["left_id"] != df["right_id"]]
+    return df.drop(columns=["_source", "_target"]).reset_index(drop=True)
+
+
+def connected_components(
+    left: npt.NDArray[Any], right: npt.NDArray[Any]
+) -> tuple[npt.NDArray[Any], npt.NDArray[Any]]:
+    """
+    Compute the connected components of the undirected graph given by the
+    edge arrays `left` and `right` via vectorized minimum label propagation
+    with pointer jumping.
+
+    Returns the unique nodes and their component label (an index into the
+    nodes array)
+    """
+    codes, nodes = pd.factorize(np.concatenate((left, right)))
+    source, target = codes[: len(left)], codes[len(left) :]
+    labels = np.arange(len(nodes))
+    while True:
+        previous = labels.copy()
+        lowest = np.minimum(labels[source], labels[target])
+        np.minimum.at(labels, source, lowest)
+        np.minimum.at(labels, target, lowest)
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return np.asarray(nodes), labels
+
+
+def _get_timestamp(ts: pd.Timestamp | None) -> str:
+    if ts is None or pd.isna(ts):
+        ts = datetime.utcnow()
+    return ts.isoformat()[:16]
+
+
+def _register_clusters(resolver: Resolver[CompositeEntity], df: pd.DataFrame) -> int:
+    # resolve positive judgements into clusters pointing to a canonical id,
+    # same as `Resolver.decide` would do edge by edge
+    if df.empty:
+        return 0
+    nodes, labels = connected_components(df["left_id"].values, df["right_id"].values)
+    # user and timestamp of the latest judgement within each component
+    components = pd.Series(labels, index=nodes)
+    df = df.assign(_label=components.loc[df["left_id"].values].values)
+    latest = df.sort_values("ts", kind="stable").drop_duplicates("_label", keep="last")
+    latest = latest.set_index("_label")
+    order = np.argsort(labels, kind="stable")
+    bounds = np.flatnonzero(np.diff(labels[order])) + 1
+    clusters = 0
+    for label, members in zip(
+        np.split(labels[order], bounds), np.split(nodes[order], bounds)
+    ):
+        component = latest.loc[label[0]]
+        user, ts = component["user"], _get_timestamp(component["ts"])
+        identifiers = [Identifier.get(m) for m in members]
+        canonical = max(identifiers)
+        if not canonical.canonical:
+            # stable across exports of the same cluster
+            key = "".join(sorted(i.id for i in identifiers))
+            canonical = Identifier.make(sha1(key.encode()).hexdigest())
+        for member in identifiers:
+            if member != canonical:
+                edge = Edge(
+                    member,
+                    canonical,
+                    judgement=Judgement.POSITIVE,
+                    user=user,
+                    timestamp=ts,
+                )
+                resolver._register(edge)
+        clusters += 1
+    return clusters
+
+
+def load_resolver(
+    engine: ClickhouseEngine | None = None,
+    datasets: Iterable[str] | None = None,
+    resolver: Resolver[CompositeEntity] | None = None,
+    chunksize: int | None = BULK_WRITE_SIZE,
+) -> Resolver[CompositeEntity]:
+    """
+    Load the xref judgements from the store into a nomenklatura `Resolver`.
+
+    Positive judgements are merged into their connected components at once
+    instead of calling `Resolver.decide` for each edge.
+    """
+    resolver = resolver or Resolver()
+    df = get_judgements(engine, datasets, chunksize=chunksize)
+    positive = df["judgement"] == Judgement.POSITIVE.value
+    clusters = _register_clusters(resolver, df[positive])
+    for row in df[~positive].itertuples(index=False):
+        edge = Edge(
+            row.left_id,
+            row.right_id,
+            judgement=Judgement(row.judgement),
+            score=None if pd.isna(row.score) else row.score,
+            user=row.user,
+            timestamp=_get_timestamp(row.ts),
+        )
+        resolver._register(edge)
+    resolver.connected.cache_clear()
+    log.info(
+        "Loaded %d judgements (%d clusters) into resolver."
+        % (len(resolver.edges), clusters)
+    )
+    return resolver
+
+
+def _iter_edges(
+    edges: Iterable[Edge], chunksize: int | None = BULK_WRITE_SIZE
+) -> Generator[pd.DataFrame, None, None]:
+    chunksize = chunksize or BULK_WRITE_SIZE
+    rows = []
+    for edge in edges:
+        rows.append(
+            (
+                edge.target.id,
+                edge.source.id,
+                edge.judgement.value,
+                edge.score,
+                edge.timestamp,
+                edge.user or "",
+            )
+        )
+        if len(rows) >= chunksize:
+            yield pd.DataFrame(rows, columns=COLUMNS_EDGES)
+            rows = []
+    if rows:
+        yield pd.DataFrame(rows, columns=COLUMNS_EDGES)
+
+
+def write_judgements(
+    edges: Iterable[Edge],
+    engine: ClickhouseEngine | None = None,
+    chunksize: int | None = BULK_WRITE_SIZE,
+) -> int:
+    """
+    Write resolver edges back to the xref table in columnar batches. Entity
+    metadata (dataset, schema, country, caption) is taken from existing xref
+    rows within ClickHouse via a staging table.
+    """
+    engine = engine or get_engine()
+    table = f"{engine.table_xref}_import_{uuid4().hex}"
+    xref = engine.table_xref
+    ids = f"SELECT target FROM {table} UNION ALL SELECT source FROM {table}"
+    entities = f"""
+    SELECT id, any(dataset) AS dataset, any(schema) AS schema,
+        any(country) AS country, any(caption) AS caption
+    FROM (
+        SELECT left_id AS id, left_dataset AS dataset, left_schema AS schema,
+            left_country AS country, left_caption AS caption
+        FROM {xref} WHERE left_id IN ({ids})
+        UNION ALL
+        SELECT right_id AS id, right_dataset AS dataset, right_schema AS schema,
+            right_country AS country, right_caption AS caption
+        FROM {xref} WHERE right_id IN ({ids})
+    ) GROUP BY id
+    """
+    # keep the orientation of already existing pairs
+    pairs = f"""
+    SELECT
+        if(swap, source, target) AS left_id,
+        if(swap, target, source) AS right_id,
+        judgement, score, ts, user
+    FROM (
+        SELECT *, (source, target) IN (
+            SELECT left_id, right_id FROM {xref}
+            WHERE left_id IN (SELECT source FROM {table})
+        ) AS swap
+        FROM {table}
+    )
+    """
+    written = 0
+    with engine.connect() as conn:
+        conn.execute(
+            f"""CREATE TABLE {table} (
+                `target`        String,
+                `source`        String,
+                `judgement`     String,
+                `score`         Float64,
+                `ts`            DateTime64,
+                `user`          String
+            ) ENGINE = Memory"""
+        )
+        try:
+            for df in _iter_edges(edges, chunksize):
+                df["score"] = df["score"].astype(float).fillna(0)
+                df["ts"] = pd.to_datetime(df["ts"]).fillna(datetime.utcnow())
+                engine.insert(df, table, "xref")
+                conn.execute(
+                    f"""INSERT INTO {xref}
+                    SELECT
+                        l.dataset, s.left_id, l.schema, l.country, l.caption,
+                        r.dataset, s.right_id, r.schema, r.country, r.caption,
+                        s.judgement, toDecimal32(s.score, 8), s.ts, s.user
+                    FROM ({pairs}) AS s
+                    LEFT JOIN ({entities}) AS l ON s.left_id = l.id
+                    LEFT JOIN ({entities}) AS r ON s.right_id = r.id"""
+                )
+                conn.execute(f"TRUNCATE TABLE {table}")
+                written += len(df)
+                log.info("Writing judgement %d ..." % written)
+        finally:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+    return written
+
+
+def write_resolver(
+    resolver: Resolver[CompositeEntity],
+    engine: ClickhouseEngine | None = None,
+    chunksize: int | None = BULK_WRITE_SIZE,
+) -> int:
+    """
+    Write all decisions of a nomenklatura `Resolver` to the xref table
+    """
+    return write_judgements(resolver.edges.values(), engine, chunksize)
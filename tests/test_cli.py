@@ -1,10 +1,13 @@
-import time
+import json
 from pathlib import Path
 
+import pytest
 from click.testing import CliRunner as CCliRunner
 from ftmq.cli import cli as ftmq
+from nomenklatura.statement import Statement
 from typer.testing import CliRunner
 
+from ftm_columnstore import get_store
 from ftm_columnstore.cli import cli
 from ftm_columnstore.settings import DATABASE_URI
 
@@ -17,6 +20,10 @@ def _get_lines(output: str) -> list[str]:
     return [li.strip() for li in lines if li.strip()]
 
 
+@pytest.mark.skipif(
+    DATABASE_URI.startswith("chdb://"),
+    reason="The ftmq cli doesn't know the chdb:// scheme",
+)
 def test_cli(fixtures_path: Path):
     res = runner.invoke(cli, "--help")
     assert res.exit_code == 0
@@ -29,10 +36,9 @@ def test_cli(fixtures_path: Path):
     res = q_runner.invoke(ftmq, ["-i", in_uri, "-o", DATABASE_URI])
     assert res.exit_code == 0
 
-    # sync after write
-    res = runner.invoke(cli, ["optimize", "--full"])
+    # sync after write, `OPTIMIZE ... FINAL` returns after the merge is done
+    res = runner.invoke(cli, ["optimize", "--incremental", "--concurrency", "2"])
     assert res.exit_code == 0
-    time.sleep(5)
 
     res = q_runner.invoke(ftmq, ["-i", DATABASE_URI])
     assert res.exit_code == 0
@@ -42,3 +48,50 @@ def test_cli(fixtures_path: Path):
     assert res.exit_code == 0
     lines = _get_lines(res.stdout)
     assert len(lines) == 474
+
+
+def test_cli_changes():
+    store = get_store(dataset="cli_changes")
+    with store.writer() as bulk:
+        for version in ("2024-01-01T00:00:00", "2024-02-01T00:00:00"):
+            stmt = Statement(
+                entity_id=f"entity-{version[:7]}",
+                prop="name",
+                schema="Person",
+                value="Jane",
+                dataset="cli_changes",
+                first_seen=version,
+                last_seen=version,
+            )
+            bulk.add_statement(stmt)
+
+    res = runner.invoke(
+        cli, ["changes", "-d", "cli_changes", "--since", "2024-01-01T00:00:00"]
+    )
+    assert res.exit_code == 0
+    changes = {
+        (c["change"], c["entity"]["id"], c["entity"]["last_seen"])
+        for c in map(json.loads, _get_lines(res.stdout))
+    }
+    assert changes == {
+        ("added", "entity-2024-02", "2024-02-01T00:00:00"),
+        ("removed", "entity-2024-01", "2024-01-01T00:00:00"),
+    }
+
+    with store.engine.connect() as conn:
+        for table in (store.engine.table, store.engine.table_fpx):
+            conn.execute(f"ALTER TABLE {table} DROP PARTITION 'cli_changes'")
+
+
+def test_cli_expand(donations):
+    store = get_store(dataset="donations")
+    with store.writer() as bulk:
+        for proxy in donations:
+            bulk.add_entity(proxy)
+
+    entity_id = "4e0bd810e1fcb49990a2b31709b6140c4c9139c5"
+    res = runner.invoke(cli, ["expand", "-i", entity_id, "-d", "donations"])
+    assert res.exit_code == 0
+    entities = [json.loads(line) for line in _get_lines(res.stdout)]
+    assert entity_id in {e["id"] for e in entities}
+    assert len(entities) == len({e["id"] for e in entities}) > 1
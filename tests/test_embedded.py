@@ -0,0 +1,47 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from ftm_columnstore import get_engine, settings
+
+
+def test_embedded(tmp_path: Path):
+    pytest.importorskip("chdb")
+    from ftm_columnstore.embedded import EmbeddedClickhouseEngine
+
+    # chDB supports only one storage path per process
+    uri = settings.DATABASE_URI
+    if not uri.startswith("chdb://"):
+        uri = f"chdb://{tmp_path}"
+    engine = get_engine(uri)
+    assert isinstance(engine, EmbeddedClickhouseEngine)
+
+    df = pd.DataFrame(
+        [
+            ("a", "ownershipOwner", "b", "embedded", "Ownership"),
+            ("a", "ownershipAsset", "c", "embedded", "Ownership"),
+            ("d", "ownershipOwner", "b", "embedded", "Ownership"),
+        ],
+        columns=["canonical_id", "prop", "value", "dataset", "schema"],
+    )
+    assert engine.insert(df, engine.table_edges) == 3
+
+    query = f"""SELECT canonical_id, value FROM {engine.table_edges}
+    WHERE dataset = 'embedded' ORDER BY canonical_id, value"""
+    res = engine.query_dataframe(query)
+    assert list(res.itertuples(index=False, name=None)) == [
+        ("a", "b"),
+        ("a", "c"),
+        ("d", "b"),
+    ]
+    assert [len(df) for df in engine.query_dataframes(query, 2)] == [2, 1]
+
+    with engine.connect() as conn:
+        cursor = conn.execute(
+            f"SELECT count() FROM {engine.table_edges} WHERE value = 'b'"
+        )
+        assert cursor.fetchone()[0] == 2
+
+    # tables are created already
+    engine.ensure(exists_ok=True)
@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+
+import pandas as pd
+import pytest
+from clickhouse_driver.errors import ErrorCodes, ServerException
+
+from ftm_columnstore import settings
+from ftm_columnstore.engine import ClickhouseEngine
+
+
+class FailingClient:
+    def __init__(self, errors: list[int]):
+        self.errors = errors
+        self.inserted: list[int] = []
+
+    def insert_dataframe(self, query: str, df: pd.DataFrame) -> int:
+        if self.errors:
+            raise ServerException("failed", code=self.errors.pop(0))
+        self.inserted.append(len(df))
+        return len(df)
+
+
+def _get_engine(client: FailingClient) -> ClickhouseEngine:
+    # no server connection needed
+    engine = ClickhouseEngine.__new__(ClickhouseEngine)
+    engine.table = "test_table"
+
+    @contextmanager
+    def _client(profile=None):
+        yield client
+
+    engine.client = _client
+    return engine
+
+
+def test_engine_insert_retry(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(settings, "WRITE_RETRIES", 3)
+    monkeypatch.setattr(settings, "WRITE_BACKOFF", 0.5)
+    monkeypatch.setattr("ftm_columnstore.engine.time.sleep", sleeps.append)
+    df = pd.DataFrame({"value": range(10)})
+
+    # back off exponentially on too many parts
+    client = FailingClient([ErrorCodes.TOO_MANY_PARTS] * 2)
+    assert _get_engine(client).insert(df) == 10
+    assert client.inserted == [10]
+    assert sleeps == [0.5, 1.0]
+
+    # split the batch on memory limits
+    sleeps.clear()
+    client = FailingClient([ErrorCodes.MEMORY_LIMIT_EXCEEDED])
+    assert _get_engine(client).insert(df) == 10
+    assert client.inserted == [5, 5]
+    assert sleeps == [0.5]
+
+    # give up after the retries
+    client = FailingClient([ErrorCodes.TOO_MANY_PARTS] * 4)
+    with pytest.raises(ServerException):
+        _get_engine(client).insert(df)
+    assert client.inserted == []
+
+    # other errors are not retried
+    sleeps.clear()
+    client = FailingClient([ErrorCodes.UNKNOWN_TABLE])
+    with pytest.raises(ServerException):
+        _get_engine(client).insert(df)
+    assert sleeps == []
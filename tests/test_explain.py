@@ -0,0 +1,83 @@
+from ftm_columnstore import get_engine
+from ftm_columnstore.explain import get_report, parse_explain
+from ftm_columnstore.store import get_store
+
+PLAN = """Expression ((Project names + Projection))
+  Expression
+    ReadFromMergeTree (default.ftm_columnstore)
+    Indexes:
+      PrimaryKey
+        Keys:
+          canonical_id
+        Condition: (canonical_id in ['a', 'a'])
+        Parts: 1/3
+        Granules: 1/30"""
+
+PROJECTIONS = """
+    Projections:
+      Name: ftm_columnstore_values
+        Description: Projection ftm_columnstore_values is usable but requires \
+reading 1 marks and does not help with sorting, which is not better than the \
+original table
+        Condition: (value in ['x', 'x'])
+        Parts: 1
+        Marks: 1
+      Name: ftm_columnstore_prop
+        Description: Projection has been analyzed and is used for part-level \
+filtering
+        Condition: (prop in ['name', 'name'])
+        Parts: 1
+        Marks: 1"""
+
+
+def test_explain_parse():
+    res = parse_explain(PLAN)
+    assert res["tables"] == ["default.ftm_columnstore"]
+    assert res["granules"] == 1
+    assert res["granules_total"] == 30
+    assert not res["full_scan"]
+
+    res = parse_explain(PLAN.replace("(canonical_id in ['a', 'a'])", "true"))
+    assert res["full_scan"]
+
+    # the key condition selects all granules
+    res = parse_explain(PLAN.replace("Granules: 1/30", "Granules: 30/30"))
+    assert res["full_scan"]
+
+    # read from a projection
+    res = parse_explain(
+        PLAN.replace("(default.ftm_columnstore)", "(ftm_columnstore_values)")
+    )
+    assert res["tables"] == []
+    assert res["projections"] == ["ftm_columnstore_values"]
+
+    # candidate projections
+    res = parse_explain(PLAN + PROJECTIONS)
+    assert res["projections"] == ["ftm_columnstore_prop"]
+
+
+def test_explain(donations):
+    store = get_store(dataset="donations")
+    with store.writer() as bulk:
+        for proxy in donations:
+            bulk.add_entity(proxy)
+
+    engine = get_engine()
+    threshold = engine.slow_query_threshold
+    engine.slow_query_threshold = 0
+    engine.slow_queries.clear()
+    try:
+        with engine.connect() as conn:
+            conn.execute(
+                f"SELECT * FROM {engine.table} WHERE canonical_id = 'unknown'"
+            ).fetchall()
+            conn.execute(f"SELECT * FROM {engine.table} WHERE lang = 'de'").fetchall()
+        reports = {r["query"]: r for r in get_report(engine.slow_queries, engine)}
+    finally:
+        engine.slow_query_threshold = threshold
+        engine.slow_queries.clear()
+
+    assert len(reports) == 2
+    for query, report in reports.items():
+        assert report["tables"]
+        assert report["full_scan"] == ("lang" in query)
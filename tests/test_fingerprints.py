@@ -1,3 +1,9 @@
+from ftm_columnstore import get_engine
+from ftm_columnstore.phonetic import get_fingerprint, get_phonetics, tokenize
+from ftm_columnstore.statements import fingerprints_from_entity
+from ftm_columnstore.store import get_store
+
+
 def test_fingerprints():
     # find similarities by phonetic algorithm
     # FIXME query here for reference
@@ -12,3 +18,52 @@ def test_fingerprints():
             GROUP BY value
             HAVING entities > 2
         ))"""
+
+
+def test_fingerprints_tokenize():
+    assert tokenize("ag holding tchibo") == {
+        "ag holding tchibo",
+        "ag",
+        "holding",
+        "tchibo",
+    }
+    assert tokenize("j smith") == {"j smith", "smith"}
+
+    phonetics = get_phonetics("Tchibo Holding AG")
+    assert set(phonetics) == {"ag holding tchibo", "ag", "holding", "tchibo"}
+    phonetics = get_phonetics(
+        "Tchibo Holding AG", stop_tokens=frozenset({"ag", "holding"})
+    )
+    assert set(phonetics) == {"ag holding tchibo", "tchibo"}
+    # the full value is kept
+    phonetics = get_phonetics("Holding", stop_tokens=frozenset({"holding"}))
+    assert phonetics == ("holding",)
+
+
+def test_fingerprints_stop_tokens(eu_authorities):
+    store = get_store(dataset="eu_authorities")
+    with store.writer() as bulk:
+        for proxy in eu_authorities:
+            bulk.add_entity(proxy)
+
+    engine = get_engine()
+    max_freq = engine.fpx_max_freq
+    engine.fpx_max_freq = 10
+    try:
+        stop_tokens = engine.get_stop_tokens(refresh=True)
+        assert "european" in stop_tokens
+        with engine.connect() as conn:
+            cursor = conn.execute(
+                f"""SELECT value FROM {engine.view_fpx_freq} GROUP BY value
+                HAVING countMerge(freq) <= 10"""
+            )
+            assert not stop_tokens & {row[0] for row in cursor.fetchall()}
+        for proxy in eu_authorities:
+            for fp in fingerprints_from_entity(proxy, stop_tokens):
+                if fp["algorithm"] == "fingerprint" and " " not in fp["value"]:
+                    assert fp["value"] not in stop_tokens or fp["value"] in [
+                        get_fingerprint(n) for n in proxy.names
+                    ]
+    finally:
+        engine.fpx_max_freq = max_freq
+        engine.get_stop_tokens(refresh=True)
@@ -0,0 +1,41 @@
+from pathlib import Path
+
+import yaml
+
+from ftm_columnstore.ingest import get_state_path, load_manifest, load_state, write_many
+from ftm_columnstore.store import get_store
+
+
+def test_ingest(fixtures_path: Path, tmp_path: Path):
+    manifest = tmp_path / "manifest.yml"
+    sources = [
+        {
+            "dataset": "eu_authorities",
+            "uri": str(fixtures_path / "eu_authorities.ftm.json"),
+        },
+        {"dataset": "donations", "uri": [str(fixtures_path / "donations.ijson")]},
+        {"dataset": "broken", "uri": str(tmp_path / "missing.ftm.json")},
+    ]
+    with open(manifest, "w") as fh:
+        yaml.dump({"sources": sources}, fh)
+    sources = load_manifest(manifest)
+    assert [s["dataset"] for s in sources] == ["eu_authorities", "donations", "broken"]
+
+    state_path = get_state_path(manifest)
+    res = {r["dataset"]: r for r in write_many(sources, state_path=state_path)}
+    assert res["eu_authorities"]["entities"] == 151
+    assert res["donations"]["entities"] == 474
+    assert res["donations"]["statements"] > res["donations"]["entities"]
+    assert res["broken"]["error"]
+    assert set(load_state(state_path)) == {"eu_authorities", "donations"}
+    assert len(list(get_store(dataset="donations").query().entities())) == 474
+
+    # resume with the unfinished datasets only
+    res = write_many(sources[:2], state_path=state_path)
+    assert res == []
+    assert not state_path.exists()
+
+    # defaults from the settings
+    res = write_many(sources[:1], concurrency=None, memory=None)
+    assert res[0]["error"] is None
+    assert res[0]["entities"] == 151
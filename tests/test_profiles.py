@@ -0,0 +1,62 @@
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from clickhouse_driver import Client
+
+from ftm_columnstore import get_engine, settings
+from ftm_columnstore.benchmark import benchmark
+from ftm_columnstore.store import get_store
+
+
+def test_profiles(monkeypatch):
+    for profile in ("ingest", "export", "xref"):
+        assert settings.PROFILES[profile]["compression"] == settings.COMPRESSION
+    assert "async_insert" not in settings.PROFILES["xref"]
+
+    monkeypatch.setenv("EXPORT_SETTINGS", "compression=zstd, max_threads=8")
+    profile = settings.get_profile("export", {"compression": "", "max_block_size": 1})
+    assert profile == {"compression": "zstd", "max_block_size": "1", "max_threads": "8"}
+
+    engine = get_engine()
+    assert engine.get_uri() == engine.uri
+    # empty values are not set
+    engine.profiles["export"] = {**profile, "compression": ""}
+    params = parse_qs(urlparse(engine.get_uri(True, "export")).query)
+    assert params == {
+        "use_numpy": ["True"],
+        "max_block_size": ["1"],
+        "max_threads": ["8"],
+    }
+    engine.profiles["export"]["compression"] = "unknown"
+    with pytest.raises(ImportError):
+        engine.get_uri(profile="export")
+    engine.profiles["export"] = dict(settings.PROFILES["export"])
+
+
+def test_profiles_client(monkeypatch):
+    # the default compression works with the installed dependencies
+    engine = get_engine()
+    monkeypatch.setattr(engine, "uri", "clickhouse://localhost:9000/default")
+    for profile in ("ingest", "export", "xref"):
+        client = Client.from_url(engine.get_uri(True, profile))
+        assert client.connection.compression
+        assert client.connection.compressor_cls is not None
+
+
+def test_profiles_benchmark(eu_authorities):
+    store = get_store(dataset="eu_authorities")
+    with store.writer() as bulk:
+        for proxy in eu_authorities:
+            bulk.add_entity(proxy)
+
+    results = benchmark(store, "eu_authorities", 5)
+    assert [(r["operation"], r["profile"]) for r in results] == [
+        ("lookup", None),
+        ("lookup", "lookup"),
+        ("export", None),
+        ("export", "export"),
+        ("ingest", None),
+        ("ingest", "ingest"),
+    ]
+    for default, profiled in zip(results[::2], results[1::2]):
+        assert default["rows"] == profiled["rows"] > 0
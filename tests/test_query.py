@@ -0,0 +1,88 @@
+from ftmq.query import Query
+
+from ftm_columnstore.query import ClickhouseQuery, ClickhouseSql
+from ftm_columnstore.store import get_store
+
+
+def test_query_compile():
+    q = Query().where(dataset="donations", schema="Payment")
+    sql = ClickhouseSql(q)
+    assert "GROUP BY canonical_id" in sql.all_canonical_ids
+    assert "HAVING" not in sql.all_canonical_ids
+    assert "uniqExact(canonical_id)" in sql.get_group_counts("schema")
+
+    q = q.where(prop="date", value=2011, comparator="gte")
+    q = q.where(prop="amountEur", value=100000, comparator="gte")
+    sql = ClickhouseSql(q)
+    assert sql.all_canonical_ids.count("countIf(") == 2
+
+    q = q.order_by("amountEur")[10:20]
+    sql = ClickhouseSql(q)
+    assert "toDecimal128OrNull" in sql.statements
+    assert "LIMIT 10 OFFSET 10" in sql.statements
+
+    q = Query().aggregate("sum", "amountEur").aggregate("max", "date")
+    sql = ClickhouseSql(q)
+    # one scan, each statement once
+    assert sql.aggregations.count(f"FROM {sql.name}") == 1
+    assert "LIMIT 1 BY id" in sql.aggregations
+
+
+def test_query_clickhouse(donations):
+    store = get_store(dataset="donations")
+    with store.writer() as bulk:
+        for proxy in donations:
+            bulk.add_entity(proxy)
+    view = store.query()
+    # the `ftmq` view methods compile via `ClickhouseSql`
+    query = view.ensure_scoped_query(Query().where(schema="Payment"))
+    assert isinstance(query, ClickhouseQuery)
+    assert isinstance(query.where(prop="date", value=2011).sql, ClickhouseSql)
+
+    # all property filters need to match
+    q = Query().where(schema="Payment", prop="date", value=2011, comparator="gte")
+    q = q.where(prop="amountEur", value=50001)
+    res = list(view.entities(q))
+    assert len(res) == len(list(q.apply_iter(donations))) == 5
+    for proxy in res:
+        assert proxy.get("amountEur") == ["50001"]
+        assert max(proxy.get("date")) >= "2011"
+
+    # stable pagination
+    q = Query().where(schema="Payment")
+    ids = [e.id for e in view.entities(q)]
+    assert ids == sorted(ids)
+    assert [e.id for e in view.entities(q[10:20])] == ids[10:20]
+    assert view.stats(q).entity_count == len(ids)
+
+    q = Query().where(schema="Payment").aggregate("avg", "amountEur")
+    q = q.aggregate("count", "id", groups="beneficiary")
+    res = view.aggregations(q)
+    assert res["count"]["id"] == len(ids)
+    assert res["avg"]["amountEur"] > 0
+    assert sum(res["groups"]["beneficiary"]["count"]["id"].values()) <= len(ids)
+
+
+def test_query_unmerged(donations):
+    store = get_store(dataset="donations")
+    # duplicate statement versions in not yet merged parts
+    with store.engine.connect() as conn:
+        conn.execute(f"SYSTEM STOP MERGES {store.engine.table}")
+    try:
+        for _ in range(2):
+            with store.writer() as bulk:
+                for proxy in donations:
+                    bulk.add_entity(proxy)
+        view = store.query()
+        q = Query().where(dataset="donations").aggregate("sum", "amountEur")
+        q = q.aggregate("count", "id", groups="year")
+        res = view.aggregations(q)
+        assert res["sum"]["amountEur"] == 40589689.15
+        assert res["count"]["id"] == len(donations)
+        q = Query().where(dataset="donations")
+        q = q.aggregate("sum", "amountEur", groups="year")
+        res = view.aggregations(q)
+        assert res["groups"]["year"]["sum"]["amountEur"]["2011"] == 1953402.15
+    finally:
+        with store.engine.connect() as conn:
+            conn.execute(f"SYSTEM START MERGES {store.engine.table}")
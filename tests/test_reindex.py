@@ -0,0 +1,192 @@
+from nomenklatura.statement import Statement
+
+from ftm_columnstore import get_engine, reindex
+from ftm_columnstore.phonetic import PhoneticAlgorithm
+from ftm_columnstore.reindex import (
+    get_names_query,
+    is_partitioned,
+    reindex_fpx,
+    reindex_freq,
+)
+from ftm_columnstore.settings import DATABASE_URI
+from ftm_columnstore.store import get_store
+
+
+def _counts(engine) -> dict[str, int]:
+    with engine.connect() as conn:
+        cursor = conn.execute(
+            f"""SELECT algorithm, count() FROM (
+                SELECT DISTINCT * FROM {engine.table_fpx}
+                WHERE dataset = 'eu_authorities'
+            ) GROUP BY algorithm"""
+        )
+        return dict(cursor.fetchall())
+
+
+def _count(engine) -> int:
+    with engine.connect() as conn:
+        cursor = conn.execute(
+            f"SELECT count() FROM (SELECT DISTINCT * FROM {engine.table_fpx})"
+        )
+        return cursor.fetchone()[0]
+
+
+def test_reindex(eu_authorities):
+    store = get_store(dataset="eu_authorities")
+    with store.writer() as bulk:
+        for proxy in eu_authorities:
+            bulk.add_entity(proxy)
+
+    engine = get_engine()
+    counts = _counts(engine)
+    assert counts[PhoneticAlgorithm.soundex] > 0
+
+    # stale fingerprints are removed
+    with engine.connect() as conn:
+        conn.execute(
+            f"""INSERT INTO {engine.table_fpx} SELECT 'soundex', 'STALE',
+            dataset, entity_id, schema, prop, prop_type FROM {engine.table_fpx}
+            WHERE dataset = 'eu_authorities' LIMIT 1"""
+        )
+    assert _counts(engine)[PhoneticAlgorithm.soundex] == counts["soundex"] + 1
+
+    res = reindex_fpx(
+        engine, ["eu_authorities"], [PhoneticAlgorithm.soundex], concurrency=3
+    )
+    assert res["eu_authorities"] >= counts["soundex"]
+    assert _counts(engine) == counts
+
+    res = reindex_fpx(engine, ["eu_authorities"])
+    assert _counts(engine) == counts
+
+
+def test_reindex_carry_over(eu_authorities, monkeypatch):
+    store = get_store(dataset="eu_authorities")
+    engine = get_engine()
+    with store.writer() as bulk:
+        for proxy in eu_authorities:
+            bulk.add_entity(proxy)
+    written = []
+
+    def _get_names_query(*args, **kwargs):
+        # a new entity and a new name of an existing one are written to the
+        # dataset during the rebuild
+        if not written:
+            with store.writer() as bulk:
+                for entity_id, value in (
+                    ("eu-authorities-reindex", "European Reindexing Agency"),
+                    ("eu-authorities-chafea", "Reindexed Executive Agency"),
+                ):
+                    bulk.add_statement(
+                        Statement(
+                            entity_id=entity_id,
+                            prop="name",
+                            schema="PublicBody",
+                            value=value,
+                            dataset="eu_authorities",
+                        )
+                    )
+            written.append(True)
+        return get_names_query(*args, **kwargs)
+
+    monkeypatch.setattr(reindex, "get_names_query", _get_names_query)
+    reindex_fpx(engine, ["eu_authorities"], [PhoneticAlgorithm.soundex])
+    assert written
+    with engine.connect() as conn:
+        cursor = conn.execute(
+            f"""SELECT DISTINCT algorithm FROM {engine.table_fpx}
+            WHERE entity_id = 'eu-authorities-reindex'"""
+        )
+        assert {row[0] for row in cursor.fetchall()} == set(PhoneticAlgorithm)
+        cursor = conn.execute(
+            f"""SELECT count() FROM {engine.table_fpx}
+            WHERE entity_id = 'eu-authorities-chafea' AND value = 'reindexed'"""
+        )
+        assert cursor.fetchone()[0] > 0
+        conn.execute(
+            f"""ALTER TABLE {engine.table} DELETE WHERE
+            entity_id = 'eu-authorities-reindex'
+            OR value = 'Reindexed Executive Agency'"""
+        )
+    # cleanup
+    reindex_fpx(engine, ["eu_authorities"])
+
+
+def test_reindex_unpartitioned(eu_authorities, donations):
+    engine = get_engine()
+    for dataset, proxies in (
+        ("eu_authorities", eu_authorities),
+        ("donations", donations),
+    ):
+        store = get_store(dataset=dataset)
+        with store.writer() as bulk:
+            for proxy in proxies:
+                bulk.add_entity(proxy)
+    counts = _counts(engine)
+    total = _count(engine)
+
+    # a fingerprint table created before partitioning by dataset
+    table = f"{engine.table_fpx}_unpartitioned"
+    settings = ""
+    if DATABASE_URI.startswith("chdb://"):
+        settings = "SETTINGS deduplicate_merge_projection_mode = 'rebuild'"
+    with engine.connect() as conn:
+        conn.execute(
+            f"""CREATE TABLE {table} AS {engine.table_fpx}
+            ENGINE = ReplacingMergeTree() PARTITION BY tuple()
+            ORDER BY (algorithm,value,prop,schema,dataset,entity_id)
+            {settings}"""
+        )
+        conn.execute(f"INSERT INTO {table} SELECT * FROM {engine.table_fpx}")
+        conn.execute(f"EXCHANGE TABLES {engine.table_fpx} AND {table}")
+    try:
+        assert not is_partitioned(engine, engine.table_fpx)
+        reindex_fpx(engine, ["eu_authorities"], [PhoneticAlgorithm.soundex])
+        assert _counts(engine) == counts
+        assert _count(engine) == total
+    finally:
+        with engine.connect() as conn:
+            conn.execute(f"EXCHANGE TABLES {engine.table_fpx} AND {table}")
+            conn.execute(f"DROP TABLE {table}")
+    assert is_partitioned(engine, engine.table_fpx)
+
+
+def test_reindex_freq(eu_authorities):
+    store = get_store(dataset="eu_authorities")
+    with store.writer() as bulk:
+        for proxy in eu_authorities:
+            bulk.add_entity(proxy)
+    engine = get_engine()
+
+    def _freqs() -> dict[str, int]:
+        with engine.connect() as conn:
+            cursor = conn.execute(
+                f"""SELECT value, countMerge(freq) FROM {engine.view_fpx_freq}
+                GROUP BY value"""
+            )
+            return dict(cursor.fetchall())
+
+    # the current stop tokens keep their frequencies
+    fpx_max_freq = engine.fpx_max_freq
+    engine.fpx_max_freq = 1
+    try:
+        stop_tokens = {v: c for v, c in _freqs().items() if c > 1}
+        assert stop_tokens
+        reindex_freq(engine)
+    finally:
+        engine.fpx_max_freq = fpx_max_freq
+    freqs = _freqs()
+    with engine.connect() as conn:
+        cursor = conn.execute(
+            f"""SELECT value, count() FROM {engine.table_fpx}
+            WHERE algorithm = 'fingerprint' GROUP BY value"""
+        )
+        expected = dict(cursor.fetchall())
+    assert freqs == {**expected, **stop_tokens}
+
+    # no staging tables left
+    with engine.connect() as conn:
+        cursor = conn.execute(
+            "SELECT name FROM system.tables WHERE name LIKE '%_reindex_%'"
+        )
+        assert not cursor.fetchall()
@@ -1,12 +1,23 @@
 import time
 
+import pytest
 from ftmq.model import Catalog, Dataset
 from ftmq.query import Query
 from ftmq.util import make_dataset
 from nomenklatura.entity import CompositeEntity
-
-from ftm_columnstore.statements import FingerprintStatement
+from nomenklatura.statement import Statement
+
+from ftm_columnstore.changes import ChangeType
+from ftm_columnstore.statements import (
+    FINGERPRINT_OVERHEAD,
+    STATEMENT_OVERHEAD,
+    FingerprintStatement,
+    deduplicate_statements,
+    fingerprint,
+    get_statement_size,
+)
 from ftm_columnstore.store import get_store
+from ftm_columnstore.view import ClickhouseView
 
 
 def test_store_base(donations):
@@ -40,6 +51,32 @@ def test_store_base(donations):
     adjacent = list(view.get_adjacent(entity))
     assert len(adjacent) == 2
 
+    # lookups are answered from the edge table (re-written datasets leave
+    # duplicate edges until they are merged)
+    assert isinstance(view, ClickhouseView)
+    with store.engine.connect() as conn:
+        cursor = conn.execute(
+            f"SELECT prop, value FROM {store.engine.table_edges} FINAL "
+            f"WHERE canonical_id = '{entity.id}'"
+        )
+        edges = cursor.fetchall()
+    assert sorted(edges) == sorted(
+        (p.name, v) for p, v in entity.itervalues() if p.type.name == "entity"
+    )
+
+    # graph expansion
+    subgraph = list(store.expand([entity.id], depth=0))
+    assert [e.id for e in subgraph] == [entity.id]
+    subgraph = {e.id for e in store.expand([entity.id], depth=1)}
+    assert subgraph == {entity.id, *(e.id for _, e in adjacent)}
+    subgraph = list(store.expand([entity.id], depth=3))
+    assert len(subgraph) > len(adjacent) + 1
+    assert len(list(store.expand([entity.id], depth=3, limit=5))) == 5
+    unbounded = list(store.expand([entity.id], depth=3, limit=None, fanout=None))
+    assert {e.id for e in unbounded} >= {e.id for e in subgraph}
+    subgraph = list(store.expand([entity.id], depth=3, schemata=["Payment"]))
+    assert {e.schema.name for e in subgraph} == {"Company", "Payment"}
+
     # FIXME delete GRANT
     # writer = store.writer()
     # stmts = writer.pop(entity.id)
@@ -51,9 +88,9 @@ def test_store_base(donations):
         cursor = conn.execute(
             f"SELECT * FROM {store.engine.table_fpx} WHERE entity_id = '4e0bd810e1fcb49990a2b31709b6140c4c9139c5'"
         )
-        row = cursor.fetchone()
-        stmt = FingerprintStatement.from_row(*row)
-        assert stmt["value"] == "ag holding tchibo"
+        stmts = [FingerprintStatement.from_row(*row) for row in cursor.fetchall()]
+        values = {s["value"] for s in stmts if s["algorithm"] == "fingerprint"}
+        assert values == {"ag holding tchibo", "ag", "holding", "tchibo"}
 
     # upsert
     with store.writer() as bulk:
@@ -66,6 +103,255 @@ def test_store_base(donations):
     assert entity.caption == "Tchibo Holding AG"
 
 
+def test_store_writer_batches(eu_authorities):
+    store = get_store(dataset="eu_authorities")
+    writer = store.writer()
+    writer.MAX_BATCH_BYTES = 10_000
+    writer.MIN_BATCH_STATEMENTS = 10
+    inserted = []
+    _upsert_batch = writer._upsert_batch
+
+    def upsert_batch():
+        inserted.append(len(writer.batch))
+        _upsert_batch()
+
+    writer._upsert_batch = upsert_batch
+    statements = 0
+    with writer:
+        for proxy in eu_authorities:
+            writer.add_entity(proxy)
+            statements += len(list(proxy.statements))
+    # batches are cut by memory size, not by statement count
+    assert len(inserted) > 1
+    assert all(i < writer.BATCH_STATEMENTS for i in inserted)
+    assert writer.batch_bytes == 0
+    assert writer.MIN_BATCH_STATEMENTS <= writer.batch_size
+    assert writer.batch_size <= writer.MAX_BATCH_STATEMENTS
+
+    stmt = next(eu_authorities[0].statements)
+    assert get_statement_size(stmt) > len(stmt.value)
+    # name statements include their fingerprint rows
+    stmt = next(s for s in eu_authorities[0].statements if s.prop == "name")
+    fingerprints = [fp for fp in fingerprint(stmt.value) if fp["value"]]
+    assert len(fingerprints) > 1
+    assert get_statement_size(stmt) > (
+        STATEMENT_OVERHEAD + len(fingerprints) * FINGERPRINT_OVERHEAD
+    )
+
+
+def test_store_optimize_incremental(donations):
+    store = get_store(dataset="donations")
+    # write twice to get fragmented parts with duplicates
+    with store.engine.connect() as conn:
+        conn.execute(f"SYSTEM STOP MERGES {store.engine.table}")
+    try:
+        for _ in range(2):
+            with store.writer() as bulk:
+                for proxy in donations:
+                    bulk.add_entity(proxy)
+
+        store.deduplicate = True
+        view = store.default_view()
+        entity = view.get_entity("4e0bd810e1fcb49990a2b31709b6140c4c9139c5")
+        statements = list(entity.statements)
+        assert len(statements) == len(list(deduplicate_statements(statements)))
+        assert len(list(view.entities())) == len(donations)
+
+        partitions = store.engine.get_partitions()
+    finally:
+        store.deduplicate = False
+        with store.engine.connect() as conn:
+            conn.execute(f"SYSTEM START MERGES {store.engine.table}")
+    assert any(
+        p["table"] == store.engine.table and p["partition"] == "donations"
+        for p in partitions
+    )
+    optimized = store.engine.optimize_partitions(concurrency=2, timeout=60)
+    assert len(optimized) == len(partitions)
+    assert not [
+        p for p in store.engine.get_partitions() if p["partition"] == "donations"
+    ]
+
+
+def test_store_backfill(donations):
+    store = get_store(dataset="donations")
+    engine = store.engine
+    with store.writer() as bulk:
+        for proxy in donations:
+            bulk.add_entity(proxy)
+    view = store.default_view()
+    entity_id = "4e0bd810e1fcb49990a2b31709b6140c4c9139c5"
+    entity = view.get_entity(entity_id)
+    adjacent = {e.id for _, e in view.get_adjacent(entity)}
+    assert adjacent
+
+    # an upgraded store: the edge table exists but is not populated yet
+    with engine.connect() as conn:
+        conn.execute(f"TRUNCATE TABLE {engine.table_edges}")
+        conn.execute(f"ALTER TABLE {engine.table_edges} MODIFY COMMENT ''")
+    assert engine.table_edges not in engine.get_backfilled(refresh=True)
+    assert {e.id for _, e in view.get_adjacent(entity)} == adjacent
+    assert {e.id for e in store.expand([entity_id])} == {entity_id, *adjacent}
+
+    engine.backfill()
+    assert engine.edges == engine.table_edges
+    assert {e.id for _, e in view.get_adjacent(entity)} == adjacent
+    with engine.connect() as conn:
+        cursor = conn.execute(f"SELECT count() FROM {engine.table_edges}")
+        assert cursor.fetchone()[0] > 0
+        cursor = conn.execute(
+            "SELECT name FROM system.tables WHERE name LIKE '%_staging%'"
+        )
+        assert not cursor.fetchall()
+
+
+def test_store_snapshots(eu_authorities):
+    store = get_store(dataset="eu_authorities")
+    engine = store.engine
+    with store.writer() as bulk:
+        for proxy in eu_authorities:
+            bulk.add_entity(proxy)
+    view = store.default_view()
+    names = view.get_entity("eu-authorities-chafea").get("name")
+
+    # enabled on an existing store: entities are read from the statements
+    # until the snapshots are backfilled
+    engine.snapshots = True
+    engine.ensure(exists_ok=True)
+    assert engine.table_entities not in engine.get_backfilled()
+    with store.writer() as bulk:
+        stmt = Statement(
+            entity_id="eu-authorities-chafea",
+            prop="alias",
+            schema="PublicBody",
+            value="New alias",
+            dataset="eu_authorities",
+        )
+        bulk.add_statement(stmt)
+    entity = view.get_entity("eu-authorities-chafea")
+    assert "New alias" in entity.get("alias")
+    assert entity.get("name") == names
+
+    engine.backfill()
+    assert engine.table_entities in engine.get_backfilled()
+    entity = view.get_snapshot("eu-authorities-chafea")
+    assert entity is not None
+    assert view.get_snapshot("unknown") is None
+    engine.snapshots = False
+    expected = view.get_entity("eu-authorities-chafea")
+    assert entity.to_dict()["properties"] == expected.to_dict()["properties"]
+    assert entity.datasets == expected.datasets
+
+    # kept up to date on write
+    engine.snapshots = True
+    with store.writer() as bulk:
+        stmt = Statement(
+            entity_id="eu-authorities-chafea",
+            prop="alias",
+            schema="PublicBody",
+            value="Snapshot alias",
+            dataset="eu_authorities",
+        )
+        bulk.add_statement(stmt)
+    entity = view.get_snapshot("eu-authorities-chafea")
+    assert "Snapshot alias" in entity.get("alias")
+    assert len(entity.get("name")) == len(expected.get("name"))
+
+    with engine.connect() as conn:
+        conn.execute(f"DROP VIEW {engine.view_entities}")
+        conn.execute(f"DROP TABLE {engine.table_entities}")
+    engine.snapshots = False
+
+
+def test_store_changes():
+    store = get_store(dataset="changes")
+
+    def _write(version: str, *entities: tuple[str, str, str]):
+        with store.writer() as bulk:
+            for entity_id, name, first_seen in entities:
+                stmt = Statement(
+                    entity_id=entity_id,
+                    prop="name",
+                    schema="Person",
+                    value=name,
+                    dataset="changes",
+                    first_seen=first_seen,
+                    last_seen=version,
+                )
+                bulk.add_statement(stmt)
+
+    v1, v2 = "2024-01-01T00:00:00", "2024-02-01T00:00:00"
+    _write(v1, ("kept", "Jane", v1), ("changed", "John", v1), ("removed", "Max", v1))
+    _write(v2, ("kept", "Jane", v1), ("changed", "Johnny", v2), ("added", "Eve", v2))
+
+    # since the previous version
+    changes = {p.id: (c, p) for c, p in store.changes("changes", v1)}
+    assert set(changes) == {"added", "changed", "removed"}
+    assert changes["added"][0] == ChangeType.added
+    assert changes["removed"][0] == ChangeType.removed
+    assert changes["removed"][1].caption == "Max"
+    change, proxy = changes["changed"]
+    assert change == ChangeType.changed
+    assert proxy.get("name") == ["Johnny"]
+
+    # nothing changed since the latest version
+    assert not list(store.changes("changes", v2))
+
+    # unchanged re-import
+    v3 = "2024-03-01T00:00:00"
+    _write(v3, ("kept", "Jane", v1), ("changed", "Johnny", v2), ("added", "Eve", v2))
+    assert not list(store.changes("changes", v2))
+    changes = {p.id: c for c, p in store.changes("changes", v1)}
+    assert changes == {
+        "added": ChangeType.added,
+        "changed": ChangeType.changed,
+        "removed": ChangeType.removed,
+    }
+
+    # cleanup
+    with store.engine.connect() as conn:
+        for table in (store.engine.table, store.engine.table_fpx):
+            conn.execute(f"ALTER TABLE {table} DROP PARTITION 'changes'")
+
+
+def test_store_changes_unstamped():
+    store = get_store(dataset="unstamped")
+
+    def _write(*entities: str) -> str:
+        writer = store.writer()
+        with writer as bulk:
+            for entity_id in entities:
+                stmt = Statement(
+                    entity_id=entity_id,
+                    prop="name",
+                    schema="Person",
+                    value=entity_id,
+                    dataset="unstamped",
+                )
+                bulk.add_statement(stmt)
+        return writer.version
+
+    v1 = _write("kept", "removed")
+    _write("kept", "added")
+    store.engine.optimize(full=True)
+    changes = {p.id: c for c, p in store.changes("unstamped", v1)}
+    assert changes == {"added": ChangeType.added, "removed": ChangeType.removed}
+
+    # statements written before the writer stamped them
+    with store.engine.connect() as conn:
+        conn.execute(
+            f"INSERT INTO {store.engine.table} (id, entity_id, canonical_id, dataset) "
+            "VALUES ('legacy', 'legacy', 'legacy', 'unstamped')"
+        )
+    with pytest.raises(ValueError):
+        list(store.changes("unstamped", v1))
+
+    # cleanup
+    with store.engine.connect() as conn:
+        for table in (store.engine.table, store.engine.table_fpx):
+            conn.execute(f"ALTER TABLE {table} DROP PARTITION 'unstamped'")
+
+
 def test_store_clickhouse(proxies):
     # same test as `ftmq`
 
@@ -191,8 +477,7 @@ def test_store_clickhouse(proxies):
             "beneficiary": {
                 "sum": {
                     "amountEur": {
-                        # "6d03aec76fdeec8f9697d8b19954ab6fc2568bc8": 3368136.15, FIXME
-                        "6d03aec76fdeec8f9697d8b19954ab6fc2568bc8": 3368136,
+                        "6d03aec76fdeec8f9697d8b19954ab6fc2568bc8": 3368136.15,
                         "783d918df9f9178400d6b3386439ab3b3679979c": 6039987,
                         "6d8377d3938b85fa1bfd1985486f0f913c42e224": 6394282,
                         "d10764ddf47ca220527d385fc8fbaa62114408e4": 660008,
@@ -207,8 +492,7 @@ def test_store_clickhouse(proxies):
                 }
             }
         },
-        # "sum": {"amountEur": 40589689.15}, FIXME
-        "sum": {"amountEur": 40589689},
+        "sum": {"amountEur": 40589689.15},
     }
     q = Query().where(dataset="donations").aggregate("sum", "amountEur", groups="year")
     res = view.aggregations(q)
@@ -217,8 +501,7 @@ def test_store_clickhouse(proxies):
             "year": {
                 "sum": {
                     "amountEur": {
-                        # "2011": 1953402.15, FIXME
-                        "2011": 1953402,
+                        "2011": 1953402.15,
                         "2010": 3899002,
                         "2009": 6451130,
                         "2008": 6002766,
@@ -232,8 +515,7 @@ def test_store_clickhouse(proxies):
                 }
             }
         },
-        # "sum": {"amountEur": 40589689.15}, FIXME
-        "sum": {"amountEur": 40589689},
+        "sum": {"amountEur": 40589689.15},
     }
 
     # reversed
@@ -0,0 +1,103 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from nomenklatura.judgement import Judgement
+from nomenklatura.resolver import Resolver
+
+from ftm_columnstore import get_engine
+from ftm_columnstore.xref import (
+    _register_clusters,
+    connected_components,
+    get_judgements,
+    load_resolver,
+    write_resolver,
+)
+
+
+def test_xref_components():
+    left = np.array(["a", "b", "x", "c", "q"], dtype=object)
+    right = np.array(["b", "c", "y", "d", "a"], dtype=object)
+    nodes, labels = connected_components(left, right)
+    components = {n: l for n, l in zip(nodes, labels)}
+    assert len(set(labels)) == 2
+    assert len({components[n] for n in "abcdq"}) == 1
+    assert components["x"] == components["y"]
+    assert components["x"] != components["a"]
+
+
+def test_xref_resolver():
+    engine = get_engine()
+    ts = datetime.now()
+    rows = [
+        ("d1", "a", "Company", "de", "A", "d2", "b", "Company", "de", "B"),
+        ("d1", "b", "Company", "de", "B", "d2", "c", "Company", "de", "C"),
+        ("d1", "a", "Company", "de", "A", "d2", "x", "Company", "de", "X"),
+    ]
+    df = pd.DataFrame(
+        rows,
+        columns=[
+            f"{side}_{c}"
+            for side in ("left", "right")
+            for c in ("dataset", "id", "schema", "country", "caption")
+        ],
+    )
+    df["judgement"] = ["positive", "positive", "negative"]
+    df["score"] = [0.9, 0.8, 0.1]
+    df["ts"] = ts
+    df["user"] = "test"
+    with engine.connect() as conn:
+        conn.execute(f"TRUNCATE TABLE {engine.table_xref}")
+        conn.execute(
+            f"INSERT INTO {engine.table_xref} VALUES "
+            + ", ".join(
+                "(%s)" % ", ".join(f"'{v}'" for v in row)
+                for row in df.astype(str).itertuples(index=False)
+            )
+        )
+
+    resolver = load_resolver(engine, datasets=["d1", "d2"])
+    assert isinstance(resolver, Resolver)
+    canonical = resolver.get_canonical("a")
+    assert canonical.startswith("NK-")
+    assert resolver.get_canonical("c") == canonical
+    assert resolver.get_canonical("x") == "x"
+    assert resolver.get_judgement("a", "x") == Judgement.NEGATIVE
+    # same canonical id for the same cluster on each export
+    assert load_resolver(engine, datasets=["d1", "d2"]).get_canonical("a") == canonical
+
+    # write back decisions
+    assert write_resolver(resolver, engine) == len(resolver.edges)
+    judgements = get_judgements(engine)
+    assert len(judgements[judgements["left_id"] == canonical]) == 3
+    resolver = load_resolver(engine)
+    assert resolver.get_canonical("b") == canonical
+
+
+def test_xref_provenance():
+    df = pd.DataFrame(
+        [
+            ("a", "b", "positive", 0.9, datetime(2024, 1, 1), "alice"),
+            ("b", "c", "positive", 0.9, datetime(2024, 1, 2), "bob"),
+            ("x", "y", "positive", 0.9, datetime(2024, 2, 1), "carol"),
+        ],
+        columns=["left_id", "right_id", "judgement", "score", "ts", "user"],
+    )
+    resolver = Resolver()
+    assert _register_clusters(resolver, df) == 2
+    resolver.connected.cache_clear()
+    edges = {e.source.id: e for e in resolver.edges.values()}
+    edges.update({e.target.id: e for e in resolver.edges.values()})
+    # each cluster keeps the user and timestamp of its own latest judgement
+    assert edges["a"].user == edges["c"].user == "bob"
+    assert edges["a"].timestamp.startswith("2024-01-02")
+    assert edges["x"].user == "carol"
+    assert edges["x"].timestamp.startswith("2024-02-01")
+
+
+def test_xref_empty():
+    engine = get_engine()
+    judgements = get_judgements(engine, datasets=["no_such_dataset"])
+    assert judgements.empty
+    resolver = load_resolver(engine, datasets=["no_such_dataset"])
+    assert not resolver.edges